@@ -0,0 +1,110 @@
+"""Payload size and latency of /api/test-history for a heavy user.
+
+Runs against an in-memory Mongo stand-in (mongomock), so no database is needed:
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/bench_test_history.py --tests 300
+"""
+import argparse
+import base64
+import contextlib
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+from common import load_server
+
+with contextlib.redirect_stdout(sys.stderr):
+    server = load_server()
+
+USER_ID = "bench-user"
+
+
+def seed_tests(collection, test_count, questions_per_test, image_bytes):
+    fake_image = "data:image/jpeg;base64," + base64.b64encode(os.urandom(image_bytes)).decode('utf-8')
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    docs = []
+    for i in range(test_count):
+        questions = [
+            {
+                "question": f"Question {j} of test {i}",
+                "options": ["1", "2", "3", "4"],
+                "answer": "A",
+                "subject": "Physics",
+                "image_data": fake_image if j % 3 == 0 else None
+            }
+            for j in range(questions_per_test)
+        ]
+        docs.append({
+            "userId": USER_ID,
+            "testType": "custom",
+            "subjects": ["Physics"],
+            "totalQuestions": questions_per_test,
+            "timeLimit": 180,
+            "questions": questions,
+            "createdAt": start + timedelta(minutes=i)
+        })
+    collection.insert_many(docs)
+
+
+def legacy_history(collection):
+    # The pre-pagination endpoint: every test, full questions arrays, one response
+    tests = collection.find({"userId": USER_ID}).sort("createdAt", -1)
+    return json.dumps({"tests": [
+        {
+            "testId": str(t["_id"]),
+            "questions": t["questions"],
+            "createdAt": t["createdAt"].isoformat(),
+        }
+        for t in tests
+    ]})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tests", type=int, default=300)
+    parser.add_argument("--questions", type=int, default=30)
+    parser.add_argument("--image-bytes", type=int, default=30000)
+    parser.add_argument("--page-size", type=int, default=server.HISTORY_PAGE_SIZE)
+    args = parser.parse_args()
+
+    collection = server.tests_collection
+    seed_tests(collection, args.tests, args.questions, args.image_bytes)
+
+    started = time.perf_counter()
+    legacy_payload = legacy_history(collection)
+    legacy_seconds = time.perf_counter() - started
+
+    client = server.app.test_client()
+    pages = 0
+    total_bytes = 0
+    first_page = None
+    cursor = None
+    started = time.perf_counter()
+    while True:
+        page_started = time.perf_counter()
+        response = client.post('/api/test-history', json={"userId": USER_ID, "limit": args.page_size, "cursor": cursor})
+        body = response.get_json()
+        pages += 1
+        total_bytes += len(response.data)
+        if first_page is None:
+            first_page = {"bytes": len(response.data), "seconds": time.perf_counter() - page_started}
+        cursor = body["nextCursor"]
+        if not body["hasMore"]:
+            break
+    paginated_seconds = time.perf_counter() - started
+
+    print(json.dumps({
+        "benchmark": "test_history",
+        "tests": args.tests,
+        "questions_per_test": args.questions,
+        "legacy": {"bytes": len(legacy_payload), "seconds": legacy_seconds},
+        "paginated_first_page": first_page,
+        "paginated_all_pages": {"pages": pages, "bytes": total_bytes, "seconds": paginated_seconds}
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_server(workdir=None):
+    """Import server.py against an in-memory Mongo stand-in, with scratch dirs for its files.
+
+    Must be called before anything else imports server.
+    """
+    import mongomock
+    import pymongo
+
+    pymongo.MongoClient = mongomock.MongoClient
+    workdir = workdir or tempfile.mkdtemp(prefix="bench-")
+    # server.py creates ./pdfs, ./pdf_images and the write journal relative to the cwd
+    os.chdir(workdir)
+    os.environ["WRITE_JOURNAL_DIR"] = os.path.join(workdir, "write_journal")
+    sys.path.insert(0, BACKEND_DIR)
+    import server
+    return server
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def summarize(samples):
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "mean": statistics.fmean(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1]
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
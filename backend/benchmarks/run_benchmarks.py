@@ -0,0 +1,205 @@
+"""Offline benchmark suite: ingestion, retrieval, generation and evaluation.
+
+Everything runs locally: the bundled PDFs in backend/pdfs, mongomock in place of MongoDB
+and a fake Groq endpoint on localhost. Results are written as JSON so runs from different
+commits can be diffed:
+
+    pip install -r benchmarks/requirements.txt
+    python benchmarks/run_benchmarks.py --output bench.json
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from common import BACKEND_DIR, git_commit, load_server, summarize, timed
+
+FAKE_MCQ_JSON = json.dumps({
+    "question": "A body moves with constant acceleration from rest. Which quantity grows linearly with time?",
+    "options": ["Displacement", "Velocity", "Acceleration", "Kinetic energy"],
+    "answer": "B"
+})
+
+FAKE_MCQ = """Q: A body moves with constant acceleration from rest. Which quantity grows linearly with time?
+A. Displacement
+B. Velocity
+C. Acceleration
+D. Kinetic energy
+Answer: B"""
+
+RETRIEVAL_QUERIES = [
+    "projectile motion",
+    "electric field of a charged sphere",
+    "chemical equilibrium constant",
+    "integration by parts",
+    "thermodynamics first law",
+    "organic reaction mechanism",
+    "simple harmonic motion",
+    "quadratic equations roots"
+]
+
+
+def start_fake_llm(latency):
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            request_body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            time.sleep(latency)
+            content = FAKE_MCQ_JSON if request_body.get("response_format", {}).get("type") == "json_object" else FAKE_MCQ
+            body = json.dumps({"choices": [{"message": {"role": "assistant", "content": content}}]}).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd, f"http://127.0.0.1:{httpd.server_port}/openai/v1/chat/completions"
+
+
+def bench_ingestion(server, pdf_dir, image_dir):
+    per_pdf = {}
+    totals = {"extract_seconds": 0.0, "store_seconds": 0.0, "streaming_seconds": 0.0}
+    pdfs = [name for name in sorted(os.listdir(pdf_dir)) if name.lower().endswith(".pdf")]
+    for filename in pdfs:
+        (questions, images, associations), extract_seconds = timed(
+            server.extract_pdf_data_enhanced, os.path.join(pdf_dir, filename), image_dir)
+        _, store_seconds = timed(server.store_enhanced_data_to_faiss, questions, images, associations)
+        per_pdf[filename] = {
+            "extract_seconds": extract_seconds,
+            "store_seconds": store_seconds,
+            "questions": len(questions),
+            "images": len(images),
+            "associations": len(associations)
+        }
+        totals["extract_seconds"] += extract_seconds
+        totals["store_seconds"] += store_seconds
+
+    # Same documents through the pipelined path; it leaves the index populated for later benchmarks
+    server.reset_indexes()
+    for filename in pdfs:
+        _, streaming_seconds = timed(server.ingest_pdf_streaming, os.path.join(pdf_dir, filename), image_dir)
+        per_pdf[filename]["streaming_seconds"] = streaming_seconds
+        totals["streaming_seconds"] += streaming_seconds
+    return {"per_pdf": per_pdf, **totals, "indexed_questions": len(server.questions_data)}
+
+
+def bench_retrieval(server, rounds):
+    samples = []
+    for _ in range(rounds):
+        for query in RETRIEVAL_QUERIES:
+            _, seconds = timed(server.retrieve_relevant_questions, query, "All", 30)
+            samples.append(seconds)
+    return summarize(samples)
+
+
+def bench_generation(server, count, runs):
+    client = server.app.test_client()
+    samples = []
+    delivered = []
+    for _ in range(runs):
+        response, seconds = timed(client.post, "/api/generate-questions", json={"subject": "All", "count": count})
+        samples.append(seconds)
+        delivered.append(len(response.get_json().get("questions", [])))
+    mcq_output = client.get("/api/stats").get_json()["mcq_output"]
+    return {**summarize(samples), "requested": count, "delivered": delivered, "mcq_output": mcq_output}
+
+
+def make_answer_sheets(question_count, students, rng):
+    questions = [
+        {
+            "question": f"Q{i}",
+            "answer": rng.choice("ABCD"),
+            "subject": ("Physics", "Chemistry", "Mathematics")[i % 3]
+        }
+        for i in range(question_count)
+    ]
+    sheets = [[rng.choice(["A", "B", "C", "D", ""]) for _ in range(question_count)] for _ in range(students)]
+    return questions, sheets
+
+
+def bench_evaluation(server, question_count, students, rng):
+    client = server.app.test_client()
+    questions, sheets = make_answer_sheets(question_count, students, rng)
+
+    single = []
+    for answers in sheets:
+        _, seconds = timed(client.post, "/api/evaluate", json={"questions": questions, "userAnswers": answers})
+        single.append(seconds)
+
+    submissions = [{"studentId": i, "userAnswers": answers} for i, answers in enumerate(sheets)]
+    _, bulk_seconds = timed(client.post, "/api/evaluate-bulk", json={"questions": questions, "submissions": submissions})
+
+    return {
+        "questions": question_count,
+        "students": students,
+        "single_request": summarize(single),
+        "single_requests_total_seconds": sum(single),
+        "bulk_seconds": bulk_seconds
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="write JSON here instead of stdout")
+    parser.add_argument("--pdf-dir", default=os.path.join(BACKEND_DIR, "pdfs"))
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="seconds the fake LLM waits per call")
+    parser.add_argument("--generate-count", type=int, default=5)
+    parser.add_argument("--generate-runs", type=int, default=2)
+    parser.add_argument("--retrieval-rounds", type=int, default=5)
+    parser.add_argument("--eval-questions", type=int, default=90)
+    parser.add_argument("--eval-students", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = tempfile.mkdtemp(prefix="bench-")
+
+    # server.py logs with print; keep stdout clean for the JSON report
+    with contextlib.redirect_stdout(sys.stderr):
+        server = load_server(workdir)
+        llm, llm_url = start_fake_llm(args.llm_latency)
+        server.GROQ_API_URL = llm_url
+        server.GROQ_API_KEY = server.GROQ_API_KEY or "bench-key"
+        try:
+            results = {
+                "ingestion": bench_ingestion(server, args.pdf_dir, os.path.join(workdir, "pdf_images")),
+                "retrieval": bench_retrieval(server, args.retrieval_rounds),
+                "generate_questions": bench_generation(server, args.generate_count, args.generate_runs),
+                "evaluate": bench_evaluation(server, args.eval_questions, args.eval_students, rng)
+            }
+        finally:
+            llm.shutdown()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args)
+        },
+        "results": results
+    }
+
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+    else:
+        print(payload)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import math
+import os
+import re
+import threading
+
+# Attempts with no success after which a chunk is never sent to the LLM again
+KNOWN_BAD_ATTEMPTS = 2
+# Chunks predicted below this yield are skipped once their features have enough history
+SKIP_BELOW = 0.1
+# Observations a feature value needs before its rate is trusted enough to skip on
+MIN_FEATURE_EVIDENCE = 20
+# Pseudo-counts pulling sparse rates towards the next broader estimate
+FEATURE_SMOOTHING = 5
+CHUNK_SMOOTHING = 2
+# generate_enhanced_mcq refuses chunks shorter than this without calling the LLM
+MIN_TEXT_LENGTH = 30
+# How far predicted yield can move a chunk within the incoming (relevance/diversity) order:
+# a certain success vs. a certain failure is worth this fraction of the list
+YIELD_ORDER_WEIGHT = 0.5
+
+
+def _logit(p):
+    p = min(max(p, 1e-4), 1 - 1e-4)
+    return math.log(p / (1 - p))
+
+
+def _sigmoid(x):
+    return 1 / (1 + math.exp(-x))
+
+
+def _word_count_bucket(count):
+    for bound in (15, 40, 100, 200):
+        if count < bound:
+            return f"<{bound}"
+    return "200+"
+
+
+def _formula_bucket(text):
+    # Chunks that are mostly symbols and digits rarely turn into a parseable MCQ
+    letters = len(re.findall(r'[A-Za-z]', text))
+    ratio = 1 - letters / max(len(text), 1)
+    return "high" if ratio > 0.6 else "medium" if ratio > 0.4 else "low"
+
+
+class CandidateYieldModel:
+    """Tracks how often chunks turn into valid MCQs and ranks new candidates by predicted yield.
+
+    Success rates are kept per chunk and per feature value (extraction pattern, word count
+    bucket, subject, source PDF, symbol density). A chunk's prediction shifts the global rate
+    by its features' average log-odds deviation, then blends in the chunk's own history.
+    Counts persist as JSON so they survive restarts.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._global = [0, 0]
+        self._features = {}
+        self._chunks = {}
+        if path and os.path.exists(path):
+            self.load()
+
+    @staticmethod
+    def chunk_key(question):
+        # Chunks never change after ingestion, so the key and features are cached on the chunk itself
+        key = question.get("_yield_key")
+        if key is None:
+            # Question ids are regenerated on every ingest, so key chunks by where they came from
+            raw = f"{question.get('source_pdf')}|{question.get('page')}|{question.get('text', '')}"
+            key = question["_yield_key"] = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+        return key
+
+    @staticmethod
+    def features(question):
+        features = question.get("_yield_features")
+        if features is None:
+            text = question.get("text", "")
+            features = question["_yield_features"] = {
+                "extraction_pattern": str(question.get("extraction_pattern")),
+                "word_count": _word_count_bucket(question.get("word_count") or len(text.split())),
+                "subject": str(question.get("subject")),
+                "source_pdf": str(question.get("source_pdf")),
+                "formula_density": _formula_bucket(text)
+            }
+        return features
+
+    def record(self, question, success):
+        with self._lock:
+            for counts in self._counts_for(question):
+                counts[0] += int(success)
+                counts[1] += 1
+
+    def _counts_for(self, question):
+        yield self._global
+        for name, value in self.features(question).items():
+            yield self._features.setdefault(f"{name}={value}", [0, 0])
+        yield self._chunks.setdefault(self.chunk_key(question), [0, 0])
+
+    def _global_rate(self):
+        successes, attempts = self._global
+        # Optimistic prior until there is history: assume half of the calls succeed
+        return (successes + 1) / (attempts + 2)
+
+    def predict(self, question):
+        with self._lock:
+            base = self._global_rate()
+            shifts = []
+            for name, value in self.features(question).items():
+                successes, attempts = self._features.get(f"{name}={value}", (0, 0))
+                if attempts:
+                    rate = (successes + FEATURE_SMOOTHING * base) / (attempts + FEATURE_SMOOTHING)
+                    shifts.append(_logit(rate) - _logit(base))
+            # Features are strongly correlated (one PDF, one subject, one pattern), so average
+            # their evidence instead of summing it the naive-Bayes way
+            predicted = _sigmoid(_logit(base) + (sum(shifts) / len(shifts) if shifts else 0))
+
+            successes, attempts = self._chunks.get(self.chunk_key(question), (0, 0))
+            return (successes + CHUNK_SMOOTHING * predicted) / (attempts + CHUNK_SMOOTHING)
+
+    def is_known_bad(self, question):
+        if len(question.get("text", "").strip()) < MIN_TEXT_LENGTH:
+            return True
+
+        with self._lock:
+            successes, attempts = self._chunks.get(self.chunk_key(question), (0, 0))
+            if attempts >= KNOWN_BAD_ATTEMPTS and successes == 0:
+                return True
+            evidence = min(
+                self._features.get(f"{name}={value}", (0, 0))[1]
+                for name, value in self.features(question).items()
+            )
+        return evidence >= MIN_FEATURE_EVIDENCE and self.predict(question) < SKIP_BELOW
+
+    def filter_candidates(self, questions):
+        return [q for q in questions if not self.is_known_bad(q)]
+
+    def rank(self, questions):
+        """Known-bad chunks dropped; the rest keep their incoming order, nudged by predicted yield.
+
+        Callers pass candidates already ordered by relevance and diversity, so yield only moves a
+        chunk by up to YIELD_ORDER_WEIGHT of the list. With no history every prediction is
+        equal and the order is unchanged.
+        """
+        candidates = self.filter_candidates(questions)
+        keys = {id(q): i / len(candidates) - YIELD_ORDER_WEIGHT * self.predict(q) for i, q in enumerate(candidates)}
+        return sorted(candidates, key=lambda q: keys[id(q)])
+
+    def summary(self):
+        with self._lock:
+            successes, attempts = self._global
+            return {
+                "attempts": attempts,
+                "successes": successes,
+                "yield": successes / attempts if attempts else None,
+                "chunks_tracked": len(self._chunks),
+                "known_bad_chunks": sum(1 for s, n in self._chunks.values() if n >= KNOWN_BAD_ATTEMPTS and s == 0),
+                "features": {key: {"successes": s, "attempts": n} for key, (s, n) in sorted(self._features.items())}
+            }
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load generation stats from {self.path}: {e}")
+            return
+        with self._lock:
+            self._global = data.get("global", [0, 0])
+            self._features = data.get("features", {})
+            self._chunks = data.get("chunks", {})
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = json.dumps({"global": self._global, "features": self._features, "chunks": self._chunks})
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(data)
+        os.replace(temp_path, self.path)
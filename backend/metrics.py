@@ -0,0 +1,153 @@
+import functools
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from flask import g, has_request_context
+
+# Latency buckets in seconds, from sub-millisecond FAISS searches up to slow LLM calls
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+_help = {}
+# Trace a worker thread records into on behalf of a request (see traced)
+_thread_trace = threading.local()
+
+
+def _key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def describe(name, text):
+    _help[name] = text
+
+
+def observe(name, seconds, trace=True, **labels):
+    """Record one duration in the `name` histogram and, by default, in the current request's trace."""
+    with _lock:
+        series = _histograms.setdefault(name, {}).setdefault(_key(labels), {
+            "buckets": [0] * len(DEFAULT_BUCKETS),
+            "sum": 0.0,
+            "count": 0
+        })
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if seconds <= bound:
+                series["buckets"][i] += 1
+        series["sum"] += seconds
+        series["count"] += 1
+
+    if trace:
+        timings = _current_timings()
+        if timings is not None:
+            label = labels.get("stage") or "_".join([name.replace("_seconds", "")] + ([labels["operation"]] if "operation" in labels else []))
+            with _lock:
+                timings[label] = timings.get(label, 0.0) + seconds
+
+
+def inc(name, amount=1, **labels):
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[_key(labels)] = series.get(_key(labels), 0) + amount
+
+
+def counter_total(name):
+    """Sum of a counter across all of its label sets."""
+    with _lock:
+        return sum(_counters.get(name, {}).values())
+
+
+@contextmanager
+def timer(name, **labels):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+
+def _current_timings():
+    if has_request_context():
+        return g.setdefault("stage_timings", {})
+    return getattr(_thread_trace, "timings", None)
+
+
+def current_trace_id():
+    if has_request_context():
+        return g.get("trace_id")
+    return getattr(_thread_trace, "trace_id", None)
+
+
+def traced(fn):
+    """Wrap fn so that, run on another thread, it records into the calling request's trace."""
+    trace_id, timings = current_trace_id(), _current_timings()
+    if timings is None:
+        return fn
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_thread_trace, "trace_id", None), getattr(_thread_trace, "timings", None)
+        _thread_trace.trace_id, _thread_trace.timings = trace_id, timings
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _thread_trace.trace_id, _thread_trace.timings = previous
+
+    return wrapper
+
+
+def start_trace(incoming_id=None):
+    g.trace_id = incoming_id or uuid.uuid4().hex
+    g.trace_started = time.perf_counter()
+    g.stage_timings = {}
+    return g.trace_id
+
+
+def log_event(event, **fields):
+    """Print one JSON log line, tagged with the request's trace id when there is one."""
+    record = {"ts": time.time(), "event": event, "trace_id": current_trace_id(), **fields}
+    print(json.dumps(record, default=str), flush=True)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (f'{k}="{_escape(v)}"' for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        for name in sorted(_counters):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} counter")
+            for labels, value in sorted(_counters[name].items()):
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for name in sorted(_histograms):
+            if name in _help:
+                lines.append(f"# HELP {name} {_help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for labels, series in sorted(_histograms[name].items()):
+                for bound, count in zip(DEFAULT_BUCKETS, series["buckets"]):
+                    lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {series['count']}")
+                lines.append(f"{name}_sum{_format_labels(labels)} {series['sum']}")
+                lines.append(f"{name}_count{_format_labels(labels)} {series['count']}")
+    return "\n".join(lines) + "\n"
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+        _counters.clear()
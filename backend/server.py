@@ -8,6 +8,7 @@ import faiss
 import uuid
 from datetime import datetime, timezone
 import base64
+import hashlib
 from io import BytesIO
 from sentence_transformers import SentenceTransformer
 from PIL import Image as PILImage
@@ -18,7 +19,19 @@ from sklearn.metrics.pairwise import cosine_similarity
 import json
 from pymongo import MongoClient
 from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError
 import pandas as pd
+import atexit
+import itertools
+import queue
+import signal
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from flask import Response, g
+from write_behind import WriteBehindQueue
+from candidate_yield import CandidateYieldModel
+import metrics
 
 dotenv_path = os.path.join(os.path.dirname(__file__), '.env')
 load_dotenv(dotenv_path)
@@ -31,6 +44,7 @@ try:
     mongo_client = MongoClient(mongo_uri)
     db = mongo_client['jeeAce']
     tests_collection = db['tests']
+    user_stats_collection = db['user_stats']
     print("✅ MongoDB connected successfully")
 except Exception as e:
     print(f"⚠️ MongoDB connection failed: {e}")
@@ -38,14 +52,69 @@ except Exception as e:
     mongo_client = None
     db = None
     tests_collection = None
+    user_stats_collection = None
+
+RECENT_TESTS_LIMIT = 5
+
+def ensure_indexes():
+    if db is None:
+        return
+    try:
+        db.test_results.create_index([("userId", 1), ("completedAt", -1)])
+        tests_collection.create_index([("userId", 1), ("createdAt", -1), ("_id", -1)])
+        print("✅ MongoDB indexes ensured")
+    except Exception as e:
+        print(f"⚠️ Could not create MongoDB indexes: {e}")
+
+ensure_indexes()
+
+def mongo_timer(operation, collection):
+    return metrics.timer("mongo_operation_seconds", operation=operation, collection=collection)
 
 pdf_folder = "./pdfs"
 output_dir = "./pdf_images"
 os.makedirs(output_dir, exist_ok=True)
 os.makedirs(pdf_folder, exist_ok=True)
 
+# Test and result saves are acknowledged once fsynced to a write-ahead log under write_journal/;
+# the queues batch them into Mongo and journal anything Mongo can't take yet, replaying it on recovery.
+journal_dir = os.getenv('WRITE_JOURNAL_DIR', "./write_journal")
+tests_write_queue = WriteBehindQueue(
+    "tests",
+    lambda: tests_collection,
+    os.path.join(journal_dir, "tests.jsonl")
+)
+results_write_queue = WriteBehindQueue(
+    "test_results",
+    lambda: db.test_results if db is not None else None,
+    os.path.join(journal_dir, "test_results.jsonl"),
+    on_written=lambda results: apply_result_rollups(results)
+)
+
+def close_write_queues():
+    tests_write_queue.close()
+    results_write_queue.close()
+
+atexit.register(close_write_queues)
+
 embedder = SentenceTransformer('all-MiniLM-L6-v2')
 
+# Per-chunk and per-feature MCQ generation outcomes, used to skip chunks that never yield
+yield_model = CandidateYieldModel(os.getenv('GENERATION_STATS_PATH', "./generation_stats.json"))
+
+# Upper bound on "time_budget", the seconds /api/generate-questions may spend before returning what it has.
+# Without a time_budget the request runs until it has enough questions or runs out of candidates.
+GENERATION_MAX_TIME_BUDGET = 600
+# Concurrent LLM calls per request when hedging slow calls ("hedge_after" in the request)
+HEDGE_MAX_IN_FLIGHT = 2
+
+# "json" asks Groq for a JSON object (response_format) and parses it with repair; "text" keeps the Q:/A./Answer: format
+MCQ_OUTPUT_MODE = os.getenv('MCQ_OUTPUT_MODE', "json")
+# Follow-up calls allowed when a reply cannot be parsed even after repair
+MCQ_REASK_LIMIT = 1
+MCQ_REASK_PROMPT_JSON = 'Your previous reply could not be parsed. Reply with ONLY the JSON object {"question": ..., "options": [4 strings], "answer": "A|B|C|D"} for the same question.'
+MCQ_REASK_PROMPT_TEXT = 'Your previous reply could not be parsed. Rewrite the same question using exactly the lines "Q:", "A.", "B.", "C.", "D." and "Answer:".'
+
 GROQ_API_KEY = os.getenv('GROQ_API_KEY')
 if GROQ_API_KEY:
     GROQ_API_KEY = GROQ_API_KEY.strip()  # Remove any whitespace
@@ -59,12 +128,57 @@ if GROQ_API_KEY:
 else:
     print("ERROR: GROQ_API_KEY not found in environment variables!")
 
-question_faiss_index = faiss.IndexFlatL2(384)
-image_faiss_index = faiss.IndexFlatL2(384)
+# ID-mapped so each vector keeps a stable 64-bit id ("faiss_id" on its metadata), one PDF's
+# vectors can be removed without rebuilding the index, and stored vectors can be read back
+question_faiss_index = faiss.IndexIDMap2(faiss.IndexFlatL2(384))
+image_faiss_index = faiss.IndexIDMap2(faiss.IndexFlatL2(384))
 
 questions_data = [] 
 images_data = []
 question_image_associations = []  
+questions_by_faiss_id = {}
+# Guards the FAISS indexes and the metadata above; ingestion appends while requests search
+index_lock = threading.RLock()
+_faiss_ids = itertools.count(1)
+# Image files handed to ingestions that haven't reached the index yet; remove_pdf_data must not delete them
+pending_image_paths = {}
+# Pages buffered between each ingestion stage (parse -> extract -> embed -> index)
+PIPELINE_QUEUE_SIZE = 4
+
+metrics.describe("stage_seconds", "Time spent in each ingestion/retrieval stage")
+metrics.describe("llm_call_seconds", "Latency of individual Groq chat completion calls")
+metrics.describe("llm_parse_failures_total", "LLM responses that did not parse into a valid MCQ")
+metrics.describe("llm_rate_limit_retries_total", "Groq calls retried after a 429")
+metrics.describe("llm_hedged_requests_total", "Extra Groq calls started because an earlier one was slow")
+metrics.describe("mongo_operation_seconds", "Latency of MongoDB operations")
+metrics.describe("http_request_seconds", "End-to-end latency of API requests")
+
+@app.before_request
+def start_request_trace():
+    metrics.start_trace(request.headers.get('X-Request-ID'))
+
+@app.after_request
+def finish_request_trace(response):
+    if "trace_id" not in g:
+        return response
+    duration = time.perf_counter() - g.trace_started
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.observe("http_request_seconds", duration, trace=False, endpoint=endpoint, method=request.method, status=response.status_code)
+    response.headers['X-Trace-Id'] = g.trace_id
+    if endpoint != '/api/metrics':
+        metrics.log_event(
+            "request",
+            method=request.method,
+            path=request.path,
+            status=response.status_code,
+            duration_seconds=round(duration, 4),
+            stages={stage: round(seconds, 4) for stage, seconds in g.stage_timings.items()}
+        )
+    return response
+
+@app.route('/api/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
@@ -82,126 +196,108 @@ def upload_pdf():
     pdf_path = os.path.join(pdf_folder, file.filename)
     file.save(pdf_path)
     
-    extracted_questions, extracted_images, associations = extract_pdf_data_enhanced(pdf_path, output_dir)
-    
-    store_enhanced_data_to_faiss(extracted_questions, extracted_images, associations)
+    # Re-uploading a revised PDF replaces only that document's data
+    replaced = remove_pdf_data(file.filename)
+    totals = ingest_pdf_streaming(pdf_path, output_dir)
     
     return jsonify({
         "message": "PDF processed successfully",
-        "questions_extracted": len(extracted_questions),
-        "images_extracted": len(extracted_images),
-        "associations_found": len(associations),
+        "questions_extracted": totals["questions"],
+        "images_extracted": totals["images"],
+        "associations_found": totals["associations"],
+        "pages_processed": totals["pages"],
+        "questions_replaced": replaced["questions_removed"],
         "pdf_name": file.filename
     }), 200
 
+@app.route('/api/pdfs/<path:pdf_name>', methods=['DELETE'])
+def delete_pdf(pdf_name):
+    pdf_name = os.path.basename(pdf_name)
+    pdf_path = os.path.join(pdf_folder, pdf_name)
+    
+    removed = remove_pdf_data(pdf_name)
+    file_deleted = os.path.exists(pdf_path)
+    if file_deleted:
+        os.remove(pdf_path)
+    
+    if not file_deleted and not removed["questions_removed"] and not removed["images_removed"]:
+        return jsonify({"error": "PDF not found"}), 404
+    
+    return jsonify({
+        "message": "PDF removed successfully",
+        "pdf_name": pdf_name,
+        "pdf_file_deleted": file_deleted,
+        **removed
+    }), 200
+
 @app.route('/api/generate-questions', methods=['POST'])
 def generate_questions_api():
     try:
+        started = time.monotonic()
         subject = request.json.get('subject', 'All')
         count = int(request.json.get('count', 10))  # Remove the 25 limit
         topics = request.json.get('topics', [])
         topic_filter = topics[0] if topics else None
+        try:
+            time_budget = _positive_seconds(request.json.get('time_budget'))
+            hedge_after = _positive_seconds(request.json.get('hedge_after'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if time_budget is not None:
+            time_budget = min(time_budget, GENERATION_MAX_TIME_BUDGET)
+        deadline = started + time_budget if time_budget is not None else None
 
         print(f"Generating {count} questions for subject: {subject}")
         print(f"Total questions in database: {len(questions_data)}")
 
-        if topic_filter:
+        selection = request.json.get('selection', 'diverse')
+
+        if selection == 'diverse':
+            # Pick from a wider pool so near-duplicate chunks from the same pages don't each cost an LLM call
+            if topic_filter:
+                candidate_pool = retrieve_relevant_questions(topic_filter, subject, count * 3 * DIVERSITY_POOL_FACTOR)
+            else:
+                candidate_pool = filter_questions_by_subject(subject, None)
+            # Only score the chunks MMR will actually look at
+            candidate_pool = yield_model.filter_candidates(downsample_candidates(candidate_pool, DIVERSITY_POOL_LIMIT))
+            relevant_questions = select_diverse_questions(candidate_pool, count * 3, query=topic_filter)
+        elif topic_filter:
             relevant_questions = retrieve_relevant_questions(topic_filter, subject, count * 3)
         else:
             relevant_questions = filter_questions_by_subject(subject, count * 3)
 
+        # Drop known-bad chunks and let likely-good ones move up a little within the relevance order
+        relevant_questions = yield_model.rank(relevant_questions)
+
         print(f"Found {len(relevant_questions)} relevant questions")
 
-        generated_questions = []
-        attempts = 0
         max_attempts = min(len(relevant_questions), count * 3)  # Try up to 3x the requested count
         
         print(f"Attempting to generate exactly {count} questions from {len(relevant_questions)} available questions")
         
-        for question_data in relevant_questions:
-            if len(generated_questions) >= count:
-                print(f"✅ Successfully generated {count} questions as requested")
-                break
-
-            attempts += 1
-            if attempts > max_attempts:
-                print(f"⚠️ Reached max attempts ({max_attempts}), stopping with {len(generated_questions)} questions")
-                break
-
-            print(f"Processing question {attempts}/{max_attempts} (Generated: {len(generated_questions)}/{count})")
-
-            # Add delay between API calls to avoid rate limiting
-            if attempts > 1:
-                time.sleep(1)  # Reduced delay for faster generation
-
-            mcq = generate_enhanced_mcq(question_data)
-
-            if mcq and mcq.get("question") and len(mcq.get("options", [])) == 4:
-                associated_image = find_associated_image(question_data['id'])
-
-                question_obj = {
-                    "question": mcq["question"],
-                    "options": mcq["options"],
-                    "answer": mcq["answer"],
-                    "subject": question_data.get("subject", "Unknown"),
-                    "source_text": question_data.get("text", "")[:200] + "...",
-                    "page": question_data.get("page"),
-                    "pdf_source": question_data.get("source_pdf")
-                }
-
-                if associated_image and os.path.exists(associated_image.get("image_path", "")):
-                    try:
-                        with open(associated_image["image_path"], "rb") as img_file:
-                            img_data = base64.b64encode(img_file.read()).decode('utf-8')
-                            question_obj["image_data"] = f"data:image/jpeg;base64,{img_data}"
-                            question_obj["image_caption"] = associated_image.get("caption", "")
-                    except Exception as e:
-                        print(f"Error loading image: {e}")
-
-                generated_questions.append(question_obj)
-                print(f"✅ Successfully generated question {len(generated_questions)}/{count}")
-            else:
-                print(f"❌ Failed to generate valid MCQ for question: {question_data.get('text', '')[:50]}...")
-
-        # If we don't have enough questions, try to generate more from remaining questions
-        if len(generated_questions) < count and len(relevant_questions) > max_attempts:
-            print(f"⚠️ Only generated {len(generated_questions)}/{count} questions. Trying additional questions...")
-            remaining_questions = relevant_questions[max_attempts:]
-            additional_attempts = 0
-            max_additional = min(len(remaining_questions), (count - len(generated_questions)) * 2)
-            
-            for question_data in remaining_questions:
-                if len(generated_questions) >= count:
-                    break
-                    
-                additional_attempts += 1
-                if additional_attempts > max_additional:
-                    break
-                    
-                print(f"Additional attempt {additional_attempts}/{max_additional}")
-                time.sleep(1)
-                
-                mcq = generate_enhanced_mcq(question_data)
-                if mcq and mcq.get("question") and len(mcq.get("options", [])) == 4:
-                    question_obj = {
-                        "question": mcq["question"],
-                        "options": mcq["options"],
-                        "answer": mcq["answer"],
-                        "subject": question_data.get("subject", "Unknown"),
-                        "source_text": question_data.get("text", "")[:200] + "...",
-                        "page": question_data.get("page"),
-                        "pdf_source": question_data.get("source_pdf")
-                    }
-                    generated_questions.append(question_obj)
-                    print(f"✅ Additional question generated: {len(generated_questions)}/{count}")
+        generated_questions, attempts, budget_exhausted = generate_from_candidates(
+            relevant_questions, count, max_attempts, deadline, hedge_after
+        )
 
         final_count = len(generated_questions)
+        elapsed = time.monotonic() - started
         print(f"🎯 Final result: Generated {final_count}/{count} questions ({(final_count/count)*100:.1f}% success rate)")
+        if budget_exhausted:
+            print(f"⏱️ Time budget of {time_budget:g}s spent; returning partial results")
+        metrics.log_event("generate_questions", subject=subject, requested=count, delivered=final_count, candidates=len(relevant_questions), attempts=attempts, elapsed_seconds=round(elapsed, 2), budget_exhausted=budget_exhausted)
+        try:
+            yield_model.save()
+        except OSError as e:
+            print(f"⚠️ Could not save generation stats: {e}")
 
         return jsonify({
             "questions": generated_questions,
             "subject": subject,
             "count": len(generated_questions),
+            "requested": count,
+            "shortfall": max(0, count - len(generated_questions)),
+            "budget_exhausted": budget_exhausted,
+            "elapsed_seconds": round(elapsed, 2),
             "total_questions_in_db": len(questions_data),
             "total_images_in_db": len(images_data)
         }), 200
@@ -209,6 +305,134 @@ def generate_questions_api():
     except Exception as e:
         print(f"Error in generate_questions_api: {e}")
         return jsonify({"error": str(e)}), 500
+
+def _positive_seconds(value):
+    if value is None or value == "":
+        return None
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Expected a number of seconds, got {value!r}")
+    if not 0 < seconds < float('inf'):
+        raise ValueError(f"Expected a positive number of seconds, got {value!r}")
+    return seconds
+
+def build_question_object(question_data, mcq):
+    question_obj = {
+        "question": mcq["question"],
+        "options": mcq["options"],
+        "answer": mcq["answer"],
+        "subject": question_data.get("subject", "Unknown"),
+        "source_text": question_data.get("text", "")[:200] + "...",
+        "page": question_data.get("page"),
+        "pdf_source": question_data.get("source_pdf")
+    }
+
+    associated_image = find_associated_image(question_data['id'])
+    if associated_image and os.path.exists(associated_image.get("image_path", "")):
+        try:
+            with open(associated_image["image_path"], "rb") as img_file:
+                img_data = base64.b64encode(img_file.read()).decode('utf-8')
+                question_obj["image_data"] = f"data:image/jpeg;base64,{img_data}"
+                question_obj["image_caption"] = associated_image.get("caption", "")
+        except Exception as e:
+            print(f"Error loading image: {e}")
+
+    return question_obj
+
+def generate_from_candidates(candidates, count, max_attempts, deadline, hedge_after=None):
+    """Turn candidates into up to `count` MCQs before `deadline` (None: no limit). Returns (questions, attempts, budget_exhausted).
+
+    Candidates are tried in order, up to max_attempts, plus up to twice the shortfall more if
+    that isn't enough. With hedge_after set, a call still running after that many seconds is
+    hedged by starting the next candidate alongside it (at most HEDGE_MAX_IN_FLIGHT at once);
+    whichever valid MCQs come back first are kept.
+    """
+    generated_questions = []
+    state = {"attempts": 0, "allowed": max_attempts, "extended": False}
+
+    def next_candidate():
+        if state["attempts"] >= state["allowed"] and not state["extended"]:
+            # If we don't have enough questions, try to generate more from remaining questions
+            state["extended"] = True
+            state["allowed"] += (count - len(generated_questions)) * 2
+            if len(candidates) > state["attempts"]:
+                print(f"⚠️ Only generated {len(generated_questions)}/{count} questions. Trying additional questions...")
+        if state["attempts"] >= min(state["allowed"], len(candidates)):
+            return None
+        state["attempts"] += 1
+        print(f"Processing question {state['attempts']}/{max_attempts} (Generated: {len(generated_questions)}/{count})")
+        return candidates[state["attempts"] - 1]
+
+    def accept(question_data, mcq):
+        if mcq and mcq.get("question") and len(mcq.get("options", [])) == 4 and len(generated_questions) < count:
+            generated_questions.append(build_question_object(question_data, mcq))
+            print(f"✅ Successfully generated question {len(generated_questions)}/{count}")
+        else:
+            print(f"❌ Failed to generate valid MCQ for question: {question_data.get('text', '')[:50]}...")
+
+    budget_exhausted = False
+
+    def out_of_time():
+        return deadline is not None and time.monotonic() >= deadline
+
+    if not hedge_after:
+        while len(generated_questions) < count:
+            if out_of_time():
+                budget_exhausted = True
+                break
+            question_data = next_candidate()
+            if question_data is None:
+                break
+
+            # Add delay between API calls to avoid rate limiting
+            if state["attempts"] > 1:
+                time.sleep(1 if deadline is None else max(0, min(1, deadline - time.monotonic())))
+
+            accept(question_data, generate_enhanced_mcq(question_data, deadline))
+    else:
+        executor = ThreadPoolExecutor(max_workers=HEDGE_MAX_IN_FLIGHT, thread_name_prefix="mcq-hedge")
+        in_flight = {}
+        try:
+            while len(generated_questions) < count:
+                now = time.monotonic()
+                if out_of_time():
+                    budget_exhausted = True
+                    break
+
+                if not in_flight:
+                    question_data = next_candidate()
+                    if question_data is None:
+                        break
+                    in_flight[executor.submit(metrics.traced(generate_enhanced_mcq), question_data, deadline)] = (question_data, now)
+                    continue
+
+                # Wake up when something finishes, when the oldest call becomes due for a hedge, or at the deadline
+                oldest_started = min(started for _, started in in_flight.values())
+                wake_at = deadline
+                if len(in_flight) < HEDGE_MAX_IN_FLIGHT:
+                    wake_at = min(wake_at, oldest_started + hedge_after) if wake_at is not None else oldest_started + hedge_after
+                timeout = max(0, wake_at - now) if wake_at is not None else None
+                done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    question_data, _ = in_flight.pop(future)
+                    try:
+                        accept(question_data, future.result())
+                    except Exception as e:
+                        print(f"Error generating MCQ: {e}")
+
+                if not done and len(in_flight) < HEDGE_MAX_IN_FLIGHT and not out_of_time():
+                    question_data = next_candidate()
+                    if question_data is not None:
+                        metrics.inc("llm_hedged_requests_total")
+                        in_flight[executor.submit(metrics.traced(generate_enhanced_mcq), question_data, deadline)] = (question_data, time.monotonic())
+        finally:
+            # Calls still running past the deadline are abandoned; their results are dropped
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return generated_questions, state["attempts"], budget_exhausted
+
 @app.route('/api/save-test', methods=['POST'])
 def save_test():
     data = request.json
@@ -229,14 +453,11 @@ def save_test():
 "createdAt": datetime.now(timezone.utc),
     }
 
-    try:
-        result = tests_collection.insert_one(test_data)
-        return jsonify({"testId": str(result.inserted_id)}), 201
-    except Exception as e:
-        print(f"MongoDB error: {e}")
-        # Generate temporary ID so test creation can continue
-        temp_id = str(uuid.uuid4())
-        return jsonify({"testId": temp_id, "warning": "Test saved locally only"}), 201
+    test_id, journaled = tests_write_queue.submit(test_data)
+    response = {"testId": str(test_id)}
+    if journaled:
+        response["warning"] = "Test queued locally; it will be stored once the database catches up"
+    return jsonify(response), 201
 
 @app.route('/api/save-test-result', methods=['POST'])
 def save_test_result():
@@ -271,13 +492,13 @@ def save_test_result():
             "createdAt": data.get('createdAt', datetime.now(timezone.utc).isoformat())
         }
 
-        result = db.test_results.insert_one(test_result)
+        result_id, journaled = results_write_queue.submit(test_result)
         
-        print(f"Test result saved with ID: {result.inserted_id}")
+        print(f"Test result queued with ID: {result_id}{' (journaled)' if journaled else ''}")
         
         return jsonify({
             "message": "Test result saved successfully",
-            "resultId": str(result.inserted_id)
+            "resultId": str(result_id)
         }), 200
         
     except Exception as e:
@@ -292,9 +513,10 @@ def get_user_test_results(user_id):
         skip = (page - 1) * limit
         
         # Fetch test results from the test_results collection
-        results = list(db.test_results.find(
-            {"userId": user_id}
-        ).sort("completedAt", -1).skip(skip).limit(limit))
+        with mongo_timer("find", "test_results"):
+            results = list(db.test_results.find(
+                {"userId": user_id}
+            ).sort("completedAt", -1).skip(skip).limit(limit))
         
         # Convert ObjectId to string and ensure all required fields exist
         for result in results:
@@ -313,7 +535,8 @@ def get_user_test_results(user_id):
                 result['totalQuestions'] = result.get('results', {}).get('total', 0)
         
         # Get total count for pagination
-        total_count = db.test_results.count_documents({"userId": user_id})
+        with mongo_timer("count_documents", "test_results"):
+            total_count = db.test_results.count_documents({"userId": user_id})
         
         return jsonify({
             "results": results,
@@ -333,28 +556,12 @@ def get_user_test_results(user_id):
 @app.route('/api/user-stats/<user_id>', methods=['GET'])
 def get_user_stats(user_id):
     try:
-        # Aggregate user statistics
-        pipeline = [
-            {"$match": {"userId": user_id}},
-            {"$group": {
-                "_id": "$userId",
-                "totalTests": {"$sum": 1},
-                "averageScore": {"$avg": "$results.percentage"},
-                "totalQuestions": {"$sum": "$totalQuestions"},
-                "totalTimeTaken": {"$sum": "$timeTaken"},
-                "bestScore": {"$max": "$results.percentage"},
-                "recentTests": {"$push": {
-                    "testName": "$testName",
-                    "score": "$results.percentage",
-                    "completedAt": "$completedAt",
-                    "subjects": "$subjects"
-                }}
-            }}
-        ]
-        
-        stats = list(db.test_results.aggregate(pipeline))
-        
-        if not stats:
+        with mongo_timer("find_one", "user_stats"):
+            rollup = user_stats_collection.find_one({"_id": user_id})
+        if rollup is None:
+            rollup = rebuild_user_rollup(user_id)
+
+        if not rollup or not rollup.get("totalTests"):
             return jsonify({
                 "totalTests": 0,
                 "averageScore": 0,
@@ -364,34 +571,24 @@ def get_user_stats(user_id):
                 "recentTests": [],
                 "subjectPerformance": []
             }), 200
-        
-        user_stats = stats[0]
-        
-        # Ensure no null values
-        user_stats["averageScore"] = user_stats.get("averageScore") or 0
-        user_stats["bestScore"] = user_stats.get("bestScore") or 0
-        user_stats["totalTimeTaken"] = user_stats.get("totalTimeTaken") or 0
-        
-        # Get subject-wise performance
-        subject_pipeline = [
-            {"$match": {"userId": user_id}},
-            {"$unwind": "$subjects"},
-            {"$group": {
-                "_id": "$subjects",
-                "averageScore": {"$avg": "$results.percentage"},
-                "testCount": {"$sum": 1}
-            }}
+
+        total_tests = rollup.get("totalTests", 0)
+        subject_stats = [
+            {
+                "_id": subject["name"],
+                "averageScore": subject["totalPercentage"] / subject["testCount"] if subject["testCount"] else 0,
+                "testCount": subject["testCount"]
+            }
+            for subject in rollup.get("subjects", {}).values()
         ]
-        
-        subject_stats = list(db.test_results.aggregate(subject_pipeline))
-        
+
         return jsonify({
-            "totalTests": user_stats.get("totalTests", 0),
-            "averageScore": round(user_stats.get("averageScore", 0), 2),
-            "totalQuestions": user_stats.get("totalQuestions", 0),
-            "totalTimeTaken": user_stats.get("totalTimeTaken", 0),
-            "bestScore": round(user_stats.get("bestScore", 0), 2),
-            "recentTests": user_stats.get("recentTests", [])[-5:],  # Last 5 tests
+            "totalTests": total_tests,
+            "averageScore": round(rollup.get("totalPercentage", 0) / total_tests, 2),
+            "totalQuestions": rollup.get("totalQuestions", 0),
+            "totalTimeTaken": rollup.get("totalTimeTaken") or 0,
+            "bestScore": round(rollup.get("bestScore") or 0, 2),
+            "recentTests": rollup.get("recentTests", []),
             "subjectPerformance": subject_stats
         }), 200
         
@@ -399,21 +596,191 @@ def get_user_stats(user_id):
         print(f"Error fetching user stats: {str(e)}")
         return jsonify({"error": f"Failed to fetch user stats: {str(e)}"}), 500
 
+def apply_result_rollups(test_results):
+    by_user = {}
+    for test_result in test_results:
+        by_user.setdefault(test_result["userId"], []).append(test_result)
+
+    for user_id, user_results in by_user.items():
+        try:
+            for test_result in sorted(user_results, key=lambda r: r["_id"]):
+                if not update_user_rollup(test_result):
+                    # A rebuild reads every stored result, including the rest of this batch
+                    rebuild_user_rollup(user_id)
+                    break
+        except Exception as e:
+            # The raw result is already stored; the rollup is rebuilt lazily on the next stats read
+            print(f"Error updating user rollup: {e}")
+            user_stats_collection.delete_one({"_id": user_id})
+
+def _as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0
+
+def _subject_key(subject):
+    # Subject names become field names inside the rollup document, so strip Mongo path operators
+    return str(subject).replace(".", "_").replace("$", "_")
+
+def update_user_rollup(test_result):
+    """Fold one stored result into its user's rollup. Returns False when the rollup needs a rebuild instead.
+
+    That is the case when the user has no rollup yet (their earlier history has to be folded in)
+    or when the result is at or below the rollup's lastResultId: either it was already counted
+    by a rebuild, or it arrived out of order from the journal. A rebuild is correct in both cases.
+    """
+
+    percentage = _as_number(test_result.get("results", {}).get("percentage"))
+    update = {
+        "$inc": {
+            "totalTests": 1,
+            "totalPercentage": percentage,
+            "totalQuestions": test_result.get("totalQuestions") or 0,
+            "totalTimeTaken": test_result.get("timeTaken") or 0
+        },
+        "$max": {"bestScore": percentage, "lastResultId": test_result["_id"]},
+        "$push": {"recentTests": {
+            "$each": [{
+                "testName": test_result.get("testName"),
+                "score": test_result.get("results", {}).get("percentage"),
+                "completedAt": test_result.get("completedAt"),
+                "subjects": test_result.get("subjects")
+            }],
+            "$slice": -RECENT_TESTS_LIMIT
+        }},
+        "$set": {"updatedAt": datetime.now(timezone.utc)}
+    }
+    for subject in set(test_result.get("subjects") or []):
+        key = f"subjects.{_subject_key(subject)}"
+        update["$inc"][f"{key}.totalPercentage"] = percentage
+        update["$inc"][f"{key}.testCount"] = 1
+        update["$set"][f"{key}.name"] = subject
+
+    with mongo_timer("update_one", "user_stats"):
+        updated = user_stats_collection.update_one(
+            {"_id": test_result["userId"], "lastResultId": {"$lt": test_result["_id"]}},
+            update
+        )
+    return updated.matched_count > 0
+
+def rebuild_user_rollup(user_id):
+    # Backfills the rollup for users whose results predate it; runs once per user
+    rollup = {
+        "_id": user_id,
+        "totalTests": 0,
+        "totalPercentage": 0,
+        "totalQuestions": 0,
+        "totalTimeTaken": 0,
+        "bestScore": 0,
+        "recentTests": [],
+        "subjects": {},
+        "lastResultId": None,
+        "updatedAt": datetime.now(timezone.utc)
+    }
+
+    projection = {"testName": 1, "results.percentage": 1, "completedAt": 1, "subjects": 1, "totalQuestions": 1, "timeTaken": 1}
+    with mongo_timer("find", "test_results"):
+        results = list(db.test_results.find({"userId": user_id}, projection).sort("_id", 1))
+
+    for result in results:
+        percentage = _as_number(result.get("results", {}).get("percentage"))
+        rollup["totalTests"] += 1
+        rollup["totalPercentage"] += percentage
+        rollup["totalQuestions"] += result.get("totalQuestions") or 0
+        rollup["totalTimeTaken"] += result.get("timeTaken") or 0
+        rollup["bestScore"] = max(rollup["bestScore"], percentage)
+        rollup["recentTests"].append({
+            "testName": result.get("testName"),
+            "score": result.get("results", {}).get("percentage"),
+            "completedAt": result.get("completedAt"),
+            "subjects": result.get("subjects")
+        })
+        rollup["recentTests"] = rollup["recentTests"][-RECENT_TESTS_LIMIT:]
+        rollup["lastResultId"] = result["_id"]
+        for subject in set(result.get("subjects") or []):
+            entry = rollup["subjects"].setdefault(_subject_key(subject), {"name": subject, "totalPercentage": 0, "testCount": 0})
+            entry["totalPercentage"] += percentage
+            entry["testCount"] += 1
+
+    if rollup["totalTests"]:
+        # Don't overwrite a rollup that already counts results newer than the ones read here
+        try:
+            with mongo_timer("replace_one", "user_stats"):
+                user_stats_collection.replace_one(
+                    {"_id": user_id, "$or": [{"lastResultId": {"$lte": rollup["lastResultId"]}}, {"lastResultId": None}]},
+                    rollup,
+                    upsert=True
+                )
+        except DuplicateKeyError:
+            pass
+    return rollup
+
+HISTORY_PAGE_SIZE = 20
+HISTORY_MAX_PAGE_SIZE = 100
+
+# Everything the history list needs except the heavy questions array (inline base64 images)
+HISTORY_PROJECTION = {
+    "testType": 1,
+    "subjects": 1,
+    "totalQuestions": 1,
+    "timeLimit": 1,
+    "createdAt": 1,
+    "score": 1,
+    "total": 1,
+    "percentage": 1,
+    "completedAt": 1
+}
+
+def encode_history_cursor(test):
+    raw = f"{test['createdAt'].isoformat()}|{test['_id']}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_history_cursor(cursor):
+    raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+    created_at, test_id = raw.rsplit("|", 1)
+    return datetime.fromisoformat(created_at), ObjectId(test_id)
+
 @app.route('/api/test-history', methods=['POST'])
 def get_test_history():
     user_id = request.json.get('userId')
     if not user_id:
         return jsonify({"error": "Missing userId"}), 400
 
-    tests = tests_collection.find({"userId": user_id}).sort("createdAt", -1)
+    try:
+        limit = int(request.json.get('limit', HISTORY_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid limit"}), 400
+    limit = max(1, min(limit, HISTORY_MAX_PAGE_SIZE))
+
+    query = {"userId": user_id}
+    cursor = request.json.get('cursor')
+    if cursor:
+        try:
+            created_at, test_id = decode_history_cursor(cursor)
+        except Exception:
+            return jsonify({"error": "Invalid cursor"}), 400
+        # Keyset pagination: resume strictly after the last (createdAt, _id) pair served
+        query["$or"] = [
+            {"createdAt": {"$lt": created_at}},
+            {"createdAt": created_at, "_id": {"$lt": test_id}}
+        ]
+
+    # Fetch one extra document to learn whether another page exists
+    with mongo_timer("find", "tests"):
+        tests = list(tests_collection.find(query, HISTORY_PROJECTION)
+                     .sort([("createdAt", -1), ("_id", -1)])
+                     .limit(limit + 1))
+    has_more = len(tests) > limit
+    tests = tests[:limit]
+
     test_list = [
         {
             "testId": str(test["_id"]),
-            "testType": test["testType"],
-            "subjects": test["subjects"],
-            "totalQuestions": test["totalQuestions"],
-            "timeLimit": test["timeLimit"],
-            "questions": test["questions"], 
+            "testType": test.get("testType"),
+            "subjects": test.get("subjects"),
+            "totalQuestions": test.get("totalQuestions"),
+            "timeLimit": test.get("timeLimit"),
             "createdAt": test["createdAt"].isoformat(),
             "score": test.get("score"),
             "total": test.get("total"),
@@ -422,7 +789,37 @@ def get_test_history():
         }
         for test in tests
     ]
-    return jsonify({"tests": test_list}), 200
+    return jsonify({
+        "tests": test_list,
+        "nextCursor": encode_history_cursor(tests[-1]) if has_more else None,
+        "hasMore": has_more
+    }), 200
+
+@app.route('/api/test/<test_id>/questions', methods=['GET'])
+def get_test_questions(test_id):
+    try:
+        query = {"_id": ObjectId(test_id)}
+    except Exception:
+        return jsonify({"error": "Invalid testId"}), 400
+
+    user_id = request.args.get('userId')
+    if user_id:
+        query["userId"] = user_id
+
+    try:
+        with mongo_timer("find_one", "tests"):
+            test = tests_collection.find_one(query, {"questions": 1})
+        if not test:
+            return jsonify({"error": "Test not found"}), 404
+
+        return jsonify({
+            "testId": test_id,
+            "questions": test.get("questions") or []
+        }), 200
+
+    except Exception as e:
+        print(f"Error fetching test questions: {str(e)}")
+        return jsonify({"error": f"Failed to fetch test questions: {str(e)}"}), 500
 
 @app.route('/api/subjects', methods=['GET'])
 def get_subjects():
@@ -435,8 +832,14 @@ def get_subjects():
         "subjects": list(subjects)
     }), 200
 
+def stage_timer(stage):
+    return metrics.timer("stage_seconds", stage=stage)
+
+def encode_texts(texts):
+    with stage_timer("embedding"):
+        return embedder.encode(texts)
+
 def extract_pdf_data_enhanced(pdf_path, output_dir):
-    doc = fitz.open(pdf_path)
     filename = os.path.basename(pdf_path)
     
     extracted_questions = []
@@ -445,71 +848,137 @@ def extract_pdf_data_enhanced(pdf_path, output_dir):
     
     current_subject = None
     
-    for page_num in range(len(doc)):
-        page = doc[page_num]
-        text = page.get_text()
-        lower_text = text.lower()
-        
-        if "physics" in lower_text:
-            current_subject = "Physics"
-        elif "chemistry" in lower_text:
-            current_subject = "Chemistry"
-        elif "math" in lower_text or "mathematics" in lower_text:
-            current_subject = "Mathematics"
-        elif "biology" in lower_text:
-            current_subject = "Biology"
-        
-        text_blocks = page.get_text("dict")
-        
-        questions_on_page = extract_questions_from_text(text, page_num, filename, current_subject)
+    for page in read_pdf_pages(pdf_path, output_dir):
+        current_subject, questions_on_page, images_on_page = extract_page_content(page, filename, current_subject)
         extracted_questions.extend(questions_on_page)
-        
-        for img_index, img in enumerate(page.get_images(full=True)):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
-            image_ext = base_image["ext"]
-            
-            image_filename = f"{filename}_p{page_num+1}_img{img_index+1}.{image_ext}"
-            image_path = os.path.join(output_dir, image_filename)
-            
-            with open(image_path, "wb") as f:
-                f.write(image_bytes)
-            
-            img_rect = fitz.Rect(img[1:5]) 
-            
-            nearby_text = extract_text_near_image(page, img_rect, distance_threshold=100)
-            
-            image_data = {
-                "id": str(uuid.uuid4()),
-                "image_path": image_path,
-                "page": page_num + 1,
-                "source_pdf": filename,
-                "subject": current_subject,
-                "position": {
-                    "x": img_rect.x0,
-                    "y": img_rect.y0,
-                    "width": img_rect.width,
-                    "height": img_rect.height
-                },
-                "caption": nearby_text,
-                "surrounding_text": text  
-            }
+        extracted_images.extend(images_on_page)
+        associations.extend(find_page_associations(questions_on_page, images_on_page))
+    
+    return extracted_questions, extracted_images, associations
+
+def read_pdf_pages(pdf_path, output_dir, claimed=None):
+    # Yields one page at a time with everything later stages need, so the fitz document never
+    # leaves this generator (PyMuPDF objects are not safe to share between threads)
+    with stage_timer("pdf_parse"):
+        doc = fitz.open(pdf_path)
+    # The same xref is often drawn on many pages (logos, repeated diagrams); extract it once
+    stored_by_xref = {}
+    
+    try:
+        for page_num in range(len(doc)):
+            with stage_timer("pdf_parse"):
+                page = doc[page_num]
+                text = page.get_text()
+                page_images = page.get_images(full=True)
+                words = page.get_text("words") if page_images else []
             
-            extracted_images.append(image_data)
+            images = []
+            for img in page_images:
+                xref = img[0]
+                if xref not in stored_by_xref:
+                    with stage_timer("image_extraction"):
+                        base_image = doc.extract_image(xref)
+                        stored_by_xref[xref] = store_image_content(base_image["image"], base_image["ext"], output_dir, claimed)
+                else:
+                    metrics.inc("images_deduplicated_total", scope="xref")
+                image_path, content_hash = stored_by_xref[xref]
+                images.append({"image_path": image_path, "content_hash": content_hash, "rect": fitz.Rect(img[1:5])})
             
-            for question in questions_on_page:
-                similarity_score = calculate_text_similarity(question["text"], nearby_text)
-                if similarity_score > 0.3:
-                    associations.append({
-                        "question_id": question["id"],
-                        "image_id": image_data["id"],
-                        "similarity_score": similarity_score,
-                        "association_type": "semantic"
-                    })
-    
-    doc.close()
-    return extracted_questions, extracted_images, associations
+            yield {"page_num": page_num, "text": text, "words": words, "images": images}
+    finally:
+        doc.close()
+
+def detect_subject(text, current_subject):
+    lower_text = text.lower()
+    
+    if "physics" in lower_text:
+        return "Physics"
+    elif "chemistry" in lower_text:
+        return "Chemistry"
+    elif "math" in lower_text or "mathematics" in lower_text:
+        return "Mathematics"
+    elif "biology" in lower_text:
+        return "Biology"
+    return current_subject
+
+def extract_page_content(page, filename, current_subject):
+    page_num = page["page_num"]
+    text = page["text"]
+    current_subject = detect_subject(text, current_subject)
+    
+    with stage_timer("regex_extraction"):
+        questions_on_page = extract_questions_from_text(text, page_num, filename, current_subject)
+    
+    images_on_page = []
+    for image in page["images"]:
+        img_rect = image["rect"]
+        
+        with stage_timer("caption_lookup"):
+            nearby_text = extract_text_near_image(page["words"], img_rect, distance_threshold=100)
+        
+        images_on_page.append({
+            "id": str(uuid.uuid4()),
+            "image_path": image["image_path"],
+            "content_hash": image["content_hash"],
+            "page": page_num + 1,
+            "source_pdf": filename,
+            "subject": current_subject,
+            "position": {
+                "x": img_rect.x0,
+                "y": img_rect.y0,
+                "width": img_rect.width,
+                "height": img_rect.height
+            },
+            "caption": nearby_text,
+            "surrounding_text": text  
+        })
+    
+    return current_subject, questions_on_page, images_on_page
+
+def find_page_associations(questions, images, question_embeddings=None):
+    captioned = [image for image in images if image["caption"]]
+    if not questions or not captioned:
+        return []
+    
+    if question_embeddings is None:
+        question_embeddings = encode_texts([question["text"] for question in questions])
+    caption_embeddings = encode_texts([image["caption"] for image in captioned])
+    similarities = cosine_similarity(caption_embeddings, question_embeddings)
+    
+    associations = []
+    for image, row in zip(captioned, similarities):
+        for question, similarity_score in zip(questions, row):
+            if similarity_score > 0.3:
+                associations.append({
+                    "question_id": question["id"],
+                    "image_id": image["id"],
+                    "similarity_score": float(similarity_score),
+                    "association_type": "semantic"
+                })
+    return associations
+
+def store_image_content(image_bytes, image_ext, output_dir, claimed=None):
+    # Files are named by content hash, so identical images across pages, PDFs and restarts share one file
+    content_hash = hashlib.sha256(image_bytes).hexdigest()
+    image_path = os.path.join(output_dir, f"{content_hash[:32]}.{image_ext}")
+
+    if claimed is not None:
+        # Claim the path before checking for the file: remove_pdf_data deletes under the same lock
+        # and skips claimed paths, so a file found here can't disappear before it is indexed
+        with index_lock:
+            pending_image_paths[image_path] = pending_image_paths.get(image_path, 0) + 1
+        claimed.append(image_path)
+
+    if os.path.exists(image_path):
+        metrics.inc("images_deduplicated_total", scope="disk")
+        return image_path, content_hash
+
+    temp_path = f"{image_path}.{uuid.uuid4().hex}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(image_bytes)
+    os.replace(temp_path, image_path)
+    metrics.inc("images_written_total")
+    return image_path, content_hash
 
 def extract_questions_from_text(text, page_num, filename, subject):
     questions = []
@@ -538,8 +1007,7 @@ def extract_questions_from_text(text, page_num, filename, subject):
     
     return questions
 
-def extract_text_near_image(page, img_rect, distance_threshold=100):
-    words = page.get_text("words")
+def extract_text_near_image(words, img_rect, distance_threshold=100):
     nearby_words = []
     
     for word in words:
@@ -557,59 +1025,198 @@ def extract_text_near_image(page, img_rect, distance_threshold=100):
     
     return " ".join(nearby_words)
 
-def calculate_text_similarity(text1, text2):
-    if not text1 or not text2:
-        return 0.0
+def embed_page_content(questions, images):
+    question_embeddings = encode_texts([question["text"] for question in questions]) if questions else None
+    image_embeddings = encode_texts([
+        f"{image.get('caption', '')} {image.get('surrounding_text', '')[:500]}" for image in images
+    ]) if images else None
+    return question_embeddings, image_embeddings
+
+def _assign_faiss_ids(items):
+    ids = np.array([next(_faiss_ids) for _ in items], dtype='int64')
+    for item, faiss_id in zip(items, ids):
+        item["faiss_id"] = int(faiss_id)
+    return ids
+
+def add_to_indexes(questions, question_embeddings, images, image_embeddings, associations):
+    with index_lock:
+        if questions:
+            question_faiss_index.add_with_ids(np.asarray(question_embeddings, dtype='float32'), _assign_faiss_ids(questions))
+            questions_data.extend(questions)
+            questions_by_faiss_id.update((question["faiss_id"], question) for question in questions)
+        
+        if images:
+            image_faiss_index.add_with_ids(np.asarray(image_embeddings, dtype='float32'), _assign_faiss_ids(images))
+            images_data.extend(images)
+        
+        question_image_associations.extend(associations)
+
+def remove_pdf_data(pdf_name):
+    """Drop one PDF's vectors, metadata, associations and unshared image files in place."""
+    with index_lock:
+        removed_questions = [q for q in questions_data if q.get("source_pdf") == pdf_name]
+        removed_images = [img for img in images_data if img.get("source_pdf") == pdf_name]
+        removed_question_ids = {q["id"] for q in removed_questions}
+        removed_image_ids = {img["id"] for img in removed_images}
+        
+        if removed_questions:
+            question_faiss_index.remove_ids(np.array([q["faiss_id"] for q in removed_questions], dtype='int64'))
+            for question in removed_questions:
+                questions_by_faiss_id.pop(question["faiss_id"], None)
+        if removed_images:
+            image_faiss_index.remove_ids(np.array([img["faiss_id"] for img in removed_images], dtype='int64'))
+        
+        # Slice assignment keeps the module-level lists the same objects
+        questions_data[:] = [q for q in questions_data if q["id"] not in removed_question_ids]
+        images_data[:] = [img for img in images_data if img["id"] not in removed_image_ids]
+        before = len(question_image_associations)
+        question_image_associations[:] = [
+            a for a in question_image_associations
+            if a["question_id"] not in removed_question_ids and a["image_id"] not in removed_image_ids
+        ]
+        removed_associations = before - len(question_image_associations)
+        
+        # Image files are content-addressed and may be shared with other PDFs or in-flight uploads
+        still_used = {img["image_path"] for img in images_data} | set(pending_image_paths)
+        orphaned = {img["image_path"] for img in removed_images} - still_used
+        
+        for image_path in orphaned:
+            try:
+                os.remove(image_path)
+            except FileNotFoundError:
+                pass
     
-    try:
-        embeddings = embedder.encode([text1, text2])
-        similarity = cosine_similarity([embeddings[0]], [embeddings[1]])[0][0]
-        return float(similarity)
-    except:
-        return 0.0
+    return {
+        "questions_removed": len(removed_questions),
+        "images_removed": len(removed_images),
+        "associations_removed": removed_associations,
+        "image_files_deleted": len(orphaned)
+    }
 
 def store_enhanced_data_to_faiss(questions, images, associations):
-    global questions_data, images_data, question_image_associations
-   
-    if questions:
-        question_embeddings = []
-        for question in questions:
-            embedding = embedder.encode(question["text"])
-            question_embeddings.append(embedding)
-            questions_data.append(question)
-        
-        if question_embeddings:
-            embeddings_np = np.array(question_embeddings, dtype='float32')
-            question_faiss_index.add(embeddings_np)
-    
-    if images:
-        image_embeddings = []
-        for image in images:
-            text_to_embed = f"{image.get('caption', '')} {image.get('surrounding_text', '')[:500]}"
-            embedding = embedder.encode(text_to_embed)
-            image_embeddings.append(embedding)
-            images_data.append(image)
-        
-        if image_embeddings:
-            embeddings_np = np.array(image_embeddings, dtype='float32')
-            image_faiss_index.add(embeddings_np)
-    
-    question_image_associations.extend(associations)
+    question_embeddings, image_embeddings = embed_page_content(questions, images)
+    add_to_indexes(questions, question_embeddings, images, image_embeddings, associations)
+
+def reset_indexes():
+    with index_lock:
+        question_faiss_index.reset()
+        image_faiss_index.reset()
+        questions_data.clear()
+        images_data.clear()
+        question_image_associations.clear()
+        questions_by_faiss_id.clear()
+
+_PIPELINE_DONE = object()
+
+def _pipeline_put(sink, item, stop):
+    while True:
+        try:
+            sink.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            if stop.is_set():
+                return False
+
+def _pipeline_stage(source, sink, work, stop, errors):
+    try:
+        while not stop.is_set():
+            item = source.get()
+            if item is _PIPELINE_DONE:
+                break
+            if not _pipeline_put(sink, work(item), stop):
+                break
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+    finally:
+        _pipeline_put(sink, _PIPELINE_DONE, stop)
+
+def ingest_pdf_streaming(pdf_path, output_dir, queue_size=PIPELINE_QUEUE_SIZE):
+    """Parse -> extract -> embed -> index, one page at a time, each stage on its own thread.
+
+    Bounded queues between stages cap memory at a few pages regardless of document size,
+    and each page is searchable as soon as it reaches the index stage.
+    """
+    filename = os.path.basename(pdf_path)
+    stop = threading.Event()
+    errors = []
+    parsed = queue.Queue(maxsize=queue_size)
+    extracted = queue.Queue(maxsize=queue_size)
+    embedded = queue.Queue(maxsize=queue_size)
+    state = {"subject": None}
+    totals = {"pages": 0, "questions": 0, "images": 0, "associations": 0}
+    claimed = []
+
+    def parse():
+        try:
+            for page in read_pdf_pages(pdf_path, output_dir, claimed):
+                if not _pipeline_put(parsed, page, stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _pipeline_put(parsed, _PIPELINE_DONE, stop)
+
+    def extract(page):
+        # Subject detection carries over from earlier pages, so this stage stays single-threaded
+        state["subject"], questions, images = extract_page_content(page, filename, state["subject"])
+        return questions, images
+
+    def embed(item):
+        questions, images = item
+        question_embeddings, image_embeddings = embed_page_content(questions, images)
+        associations = find_page_associations(questions, images, question_embeddings)
+        return questions, question_embeddings, images, image_embeddings, associations
+
+    workers = [
+        threading.Thread(target=metrics.traced(parse), name=f"ingest-parse-{filename}", daemon=True),
+        threading.Thread(target=metrics.traced(_pipeline_stage), args=(parsed, extracted, extract, stop, errors), name=f"ingest-extract-{filename}", daemon=True),
+        threading.Thread(target=metrics.traced(_pipeline_stage), args=(extracted, embedded, embed, stop, errors), name=f"ingest-embed-{filename}", daemon=True)
+    ]
+    for worker in workers:
+        worker.start()
+
+    try:
+        while not stop.is_set():
+            item = embedded.get()
+            if item is _PIPELINE_DONE:
+                break
+            questions, question_embeddings, images, image_embeddings, associations = item
+            add_to_indexes(questions, question_embeddings, images, image_embeddings, associations)
+            totals["pages"] += 1
+            totals["questions"] += len(questions)
+            totals["images"] += len(images)
+            totals["associations"] += len(associations)
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join()
+        # Everything this upload will index is in images_data by now
+        with index_lock:
+            for image_path in claimed:
+                pending_image_paths[image_path] -= 1
+                if not pending_image_paths[image_path]:
+                    del pending_image_paths[image_path]
+
+    if errors:
+        raise errors[0]
+    return totals
 
 def retrieve_relevant_questions(query, subject, k=10):
     if not questions_data:
         return []
     
-    query_embedding = embedder.encode([query])
+    query_embedding = encode_texts([query])
     
-    distances, indices = question_faiss_index.search(query_embedding.astype('float32'), min(k*2, len(questions_data)))
+    with index_lock, stage_timer("faiss_search"):
+        distances, indices = question_faiss_index.search(query_embedding.astype('float32'), min(k*2, len(questions_data)))
+        candidates = [questions_by_faiss_id[idx] for idx in indices[0] if idx in questions_by_faiss_id]
     
     relevant_questions = []
-    for idx in indices[0]:
-        if idx < len(questions_data):
-            question = questions_data[idx]
-            if subject == 'All' or question.get('subject') == subject:
-                relevant_questions.append(question)
+    for question in candidates:
+        if subject == 'All' or question.get('subject') == subject:
+            relevant_questions.append(question)
     
     return relevant_questions[:k]
 
@@ -621,6 +1228,76 @@ def filter_questions_by_subject(subject, k=10):
     
     return filtered_questions[:k]
 
+# Maximal marginal relevance: weight on relevance to the topic vs. novelty against picks so far
+MMR_LAMBDA = 0.7
+# How much larger the retrieval pool is than the number of candidates we keep
+DIVERSITY_POOL_FACTOR = 4
+# Subject-wide pools are down-sampled evenly to this size before selection
+DIVERSITY_POOL_LIMIT = 2000
+# Penalty for taking a second chunk from a PDF, scaled by that PDF's share of picks so far
+PDF_SPREAD_WEIGHT = 0.1
+
+def get_question_embeddings(questions):
+    with index_lock:
+        present = [q for q in questions if q.get("faiss_id") in questions_by_faiss_id]
+        if not present:
+            return present, np.zeros((0, question_faiss_index.d), dtype='float32')
+        ids = np.array([q["faiss_id"] for q in present], dtype='int64')
+        return present, question_faiss_index.reconstruct_batch(ids)
+
+def downsample_candidates(candidates, limit):
+    # Evenly spaced, so every part of the pool (and every PDF in it) stays represented
+    if len(candidates) <= limit:
+        return candidates
+    step = len(candidates) / limit
+    return [candidates[int(i * step)] for i in range(limit)]
+
+def select_diverse_questions(candidates, k, query=None):
+    """Greedy MMR over stored embeddings, spreading picks across pages and source PDFs.
+
+    Without a query every candidate is equally relevant and this reduces to picking the
+    chunk least similar to anything chosen so far.
+    """
+    candidates = downsample_candidates(candidates, DIVERSITY_POOL_LIMIT)
+    candidates, embeddings = get_question_embeddings(candidates)
+    if len(candidates) <= 1:
+        return candidates[:k]
+    
+    with stage_timer("diversity_selection"):
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.maximum(norms, 1e-12)
+        
+        if query:
+            query_embedding = np.asarray(encode_texts([query]), dtype='float32')[0]
+            relevance = embeddings @ (query_embedding / max(np.linalg.norm(query_embedding), 1e-12))
+        else:
+            relevance = np.ones(len(candidates), dtype='float32')
+        
+        pages = np.array([f"{q.get('source_pdf')}#{q.get('page')}" for q in candidates])
+        _, pdf_codes = np.unique([str(q.get('source_pdf')) for q in candidates], return_inverse=True)
+        pdf_picks = np.zeros(pdf_codes.max() + 1, dtype='float32')
+        
+        max_similarity = np.full(len(candidates), -1.0, dtype='float32')
+        available = np.ones(len(candidates), dtype=bool)
+        selected = []
+        
+        for _ in range(min(k, len(candidates))):
+            redundancy = max_similarity.copy()
+            pdf_share = pdf_picks[pdf_codes] / max(len(selected), 1)
+            scores = MMR_LAMBDA * relevance - (1 - MMR_LAMBDA) * redundancy - PDF_SPREAD_WEIGHT * pdf_share
+            scores[~available] = -np.inf
+            
+            best = int(np.argmax(scores))
+            selected.append(candidates[best])
+            available[best] = False
+            pdf_picks[pdf_codes[best]] += 1
+            
+            max_similarity = np.maximum(max_similarity, embeddings @ embeddings[best])
+            # Another chunk from an already-used page counts as a near-duplicate
+            max_similarity[pages == pages[best]] = 1.0
+    
+    return selected
+
 def find_associated_image(question_id):
     for association in question_image_associations:
         if association["question_id"] == question_id:
@@ -630,15 +1307,20 @@ def find_associated_image(question_id):
                     return image
     return None
 
-def generate_enhanced_mcq(question_data):
-    text = question_data.get("text", "")
-    subject = question_data.get("subject", "")
-    
-    # If text is too short, skip
-    if len(text.strip()) < 30:
-        return None
+def build_mcq_prompt(text, subject, json_mode):
+    if json_mode:
+        output_format = """Respond with ONLY a JSON object, no prose and no code fences, matching this schema:
+{"question": "<question text>", "options": ["<option A>", "<option B>", "<option C>", "<option D>"], "answer": "<A|B|C|D>"}"""
+    else:
+        output_format = """Format your response EXACTLY like this:
+Q: [Your question here]
+A. [Option A]
+B. [Option B]  
+C. [Option C]
+D. [Option D]
+Answer: [A/B/C/D]"""
     
-    prompt = f"""
+    return f"""
 You are an expert JEE {subject} tutor. Based on the following question/content from a JEE preparation material, generate one high-quality multiple-choice question with exactly 4 options.
 
 Content:
@@ -652,58 +1334,63 @@ Requirements:
 - If the content contains a specific question, adapt it into MCQ format
 - If the content is explanatory, create a question that tests the concept
 
-Format your response EXACTLY like this:
-Q: [Your question here]
-A. [Option A]
-B. [Option B]  
-C. [Option C]
-D. [Option D]
-Answer: [A/B/C/D]
+{output_format}
 """
+
+def request_llm_completion(messages, json_mode=False, deadline=None):
+    """POST one chat completion to Groq, retrying 429s and transport errors. Returns the text or None.
+
+    With a deadline (time.monotonic() value), timeouts shrink to fit and no retry sleeps past it.
+    """
+    payload = {
+        'model': GROQ_MODEL,
+        'messages': messages,
+        'temperature': 0.7,
+        'max_completion_tokens': 1024,
+        'top_p': 1,
+        'stream': False
+    }
+    if json_mode:
+        payload['response_format'] = {'type': 'json_object'}
+    
+    def remaining():
+        return float('inf') if deadline is None else deadline - time.monotonic()
     
     max_retries = 3
     for attempt in range(max_retries):
+        if remaining() <= 0:
+            return None
         try:
+            llm_started = time.perf_counter()
             response = requests.post(
                 GROQ_API_URL,
                 headers={
                     'Authorization': f'Bearer {GROQ_API_KEY}',
                     'Content-Type': 'application/json'
                 },
-                json={
-                    'model': GROQ_MODEL,
-                    'messages': [{'role': 'user', 'content': prompt}],
-                    'temperature': 0.7,
-                    'max_completion_tokens': 1024,
-                    'top_p': 1,
-                    'stream': False
-                },
-                timeout=30
+                json=payload,
+                timeout=min(30, max(remaining(), 1))
             )
+            metrics.observe("llm_call_seconds", time.perf_counter() - llm_started, status=response.status_code)
             
             if response.status_code == 200:
                 response_data = response.json()
                 if "choices" in response_data and response_data["choices"]:
-                    mcq_text = response_data["choices"][0]["message"]["content"].strip()
-                    parsed_mcq = parse_mcq_string(mcq_text)
-                    
-                    # Validate the parsed MCQ
-                    if (parsed_mcq and 
-                        parsed_mcq.get("question") and 
-                        len(parsed_mcq.get("options", [])) == 4 and 
-                        parsed_mcq.get("answer") in ["A", "B", "C", "D"]):
-                        return parsed_mcq
-                    else:
-                        print(f"Invalid MCQ format for question: {text[:50]}...")
-                        return None
+                    return (response_data["choices"][0]["message"].get("content") or "").strip()
+                return None
             elif response.status_code == 429:
                 print(f"Rate limit hit, attempt {attempt + 1}/{max_retries}")
-                if attempt < max_retries - 1:
+                if attempt < max_retries - 1 and remaining() > 5 * (attempt + 1):
+                    metrics.inc("llm_rate_limit_retries_total")
                     time.sleep(5 * (attempt + 1))  # Exponential backoff: 5s, 10s, 15s
                     continue
                 else:
                     print(f"Max retries reached for rate limiting")
                     return None
+            elif response.status_code == 400 and json_mode and "json" in response.text.lower():
+                # Groq rejects json_object replies it cannot validate; the re-ask path can still recover
+                print(f"GROQ rejected JSON output: {response.text[:200]}")
+                return ""
             else:
                 print(f"GROQ API error: {response.status_code}")
                 print(f"Response content: {response.text}")
@@ -712,13 +1399,148 @@ Answer: [A/B/C/D]
                 
         except Exception as e:
             print(f"Error generating MCQ (attempt {attempt + 1}): {e}")
-            if attempt < max_retries - 1:
+            if isinstance(e, requests.RequestException):
+                metrics.observe("llm_call_seconds", time.perf_counter() - llm_started, status="error")
+            if attempt < max_retries - 1 and remaining() > 2:
                 time.sleep(2)
                 continue
             else:
                 return None
     
     return None
+
+def generate_enhanced_mcq(question_data, deadline=None):
+    text = question_data.get("text", "")
+    subject = question_data.get("subject", "")
+    
+    # If text is too short, skip
+    if len(text.strip()) < 30:
+        return None
+    
+    json_mode = MCQ_OUTPUT_MODE == "json"
+    messages = [{'role': 'user', 'content': build_mcq_prompt(text, subject, json_mode)}]
+    
+    for call in range(1 + MCQ_REASK_LIMIT):
+        mcq_text = request_llm_completion(messages, json_mode, deadline)
+        if mcq_text is None:
+            # Rate limits and API errors say nothing about this chunk; don't count them against it
+            return None
+        metrics.inc("mcq_llm_calls_total", purpose="reask" if call else "generate")
+        
+        parsed_mcq, recovered_by = repair_mcq_output(mcq_text)
+        if parsed_mcq:
+            recovered_by = "reask" if call else recovered_by
+            metrics.inc("mcq_valid_total", recovered_by=recovered_by)
+            yield_model.record(question_data, True)
+            return parsed_mcq
+        
+        print(f"Invalid MCQ format for question: {text[:50]}...")
+        metrics.inc("llm_parse_failures_total")
+        metrics.log_event("llm_parse_failure", question_id=question_data.get("id"), call=call + 1)
+        
+        # Targeted re-ask: show the model its own reply and ask only for the fixed format
+        messages = messages + [
+            {'role': 'assistant', 'content': mcq_text},
+            {'role': 'user', 'content': MCQ_REASK_PROMPT_JSON if json_mode else MCQ_REASK_PROMPT_TEXT}
+        ]
+    
+    yield_model.record(question_data, False)
+    return None
+
+def is_valid_mcq(mcq):
+    return bool(
+        mcq and
+        mcq.get("question") and
+        len(mcq.get("options", [])) == 4 and
+        all(mcq["options"]) and
+        mcq.get("answer") in ["A", "B", "C", "D"]
+    )
+
+def repair_mcq_output(mcq_text):
+    """Best-effort parse of an LLM reply. Returns (mcq, how it was recovered) or (None, None)."""
+    parsers = (
+        ("json", parse_mcq_json),
+        ("text", parse_mcq_string),
+        ("repair", parse_mcq_loose)
+    )
+    for name, parser in parsers:
+        mcq = parser(mcq_text)
+        if is_valid_mcq(mcq):
+            return mcq, name
+    return None, None
+
+_OPTION_PREFIX = re.compile(r'^\s*\(?([A-Da-d])[\.\):]\s+')
+
+def _normalize_answer(answer, options):
+    answer = str(answer or "").strip()
+    # Some replies name the correct option by its text instead of its letter; an option such as
+    # "A ball" must not be mistaken for the letter A, so exact text wins
+    for letter, option in zip("ABCD", options):
+        if answer and answer.lower() == str(option).strip().lower():
+            return letter
+    match = re.match(r'^(?:option\s*)?(?:\(([A-Da-d])\)|([A-Da-d])(?:[\.\):]|$))', answer, re.IGNORECASE)
+    if match:
+        return (match.group(1) or match.group(2)).upper()
+    return ""
+
+def parse_mcq_json(mcq_str):
+    cleaned = re.sub(r'^```(?:json)?|```$', '', mcq_str.strip(), flags=re.MULTILINE).strip()
+    start, end = cleaned.find("{"), cleaned.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    candidate = cleaned[start:end + 1]
+    
+    try:
+        data = json.loads(candidate)
+    except ValueError:
+        # Common near-misses: trailing commas and smart quotes
+        candidate = re.sub(r',\s*([}\]])', r'\1', candidate)
+        candidate = candidate.replace("\u201c", '"').replace("\u201d", '"')
+        try:
+            data = json.loads(candidate)
+        except ValueError:
+            return None
+    if not isinstance(data, dict):
+        return None
+    
+    data = {str(k).lower(): v for k, v in data.items()}
+    options = data.get("options") or data.get("choices") or []
+    if isinstance(options, dict):
+        options = [options.get(letter) or options.get(letter.lower()) or "" for letter in "ABCD"]
+    if not isinstance(options, list):
+        return None
+    options = [_OPTION_PREFIX.sub("", str(option)).strip() for option in options]
+    
+    return {
+        "question": str(data.get("question") or "").strip(),
+        "options": options,
+        "answer": _normalize_answer(data.get("answer") or data.get("correct_answer"), options)
+    }
+
+def parse_mcq_loose(mcq_str):
+    # Tolerates markdown emphasis, "Question:" labels and "A)"/"(A)" option markers
+    text = mcq_str.replace("**", "")
+    option_matches = list(re.finditer(r'^\s*\(?([A-D])[\.\):]\s*(.+)$', text, re.MULTILINE))
+    options = {}
+    for match in option_matches:
+        options.setdefault(match.group(1), match.group(2).strip())
+    if len(options) != 4 or not option_matches:
+        return None
+    
+    q_match = re.search(r'Q(?:uestion)?\s*\d*\s*[:.]\s*(.*)', text[:option_matches[0].start()], re.DOTALL | re.IGNORECASE)
+    question = q_match.group(1) if q_match else text[:option_matches[0].start()]
+    
+    ordered = [options[letter] for letter in "ABCD"]
+    # The last "Answer" line wins; the word can also appear inside the question
+    ans_matches = re.findall(r'answer\s*(?:is)?\s*[:\-]?\s*(.+)', text[option_matches[-1].end():], re.IGNORECASE)
+    answer = _normalize_answer(ans_matches[-1] if ans_matches else "", ordered)
+    
+    return {
+        "question": question.strip(),
+        "options": ordered,
+        "answer": answer
+    }
+
 def parse_mcq_string(mcq_str):
     try:
         # Extract question
@@ -764,7 +1586,8 @@ def get_test_result_details(result_id):
     try:
         from bson.objectid import ObjectId
         
-        result = db.test_results.find_one({"_id": ObjectId(result_id)})
+        with mongo_timer("find_one", "test_results"):
+            result = db.test_results.find_one({"_id": ObjectId(result_id)})
         
         if not result:
             return jsonify({"error": "Test result not found"}), 404
@@ -850,6 +1673,139 @@ def evaluate():
         }
     }), 200
 
+# JEE Marking Scheme: +4 for correct, -1 for incorrect, 0 for unattempted
+MARKS_CORRECT = 4
+MARKS_INCORRECT = -1
+OPTION_LABELS = np.array(["A", "B", "C", "D"])
+
+@app.route('/api/evaluate-bulk', methods=['POST'])
+def evaluate_bulk():
+    request_data = request.get_json(silent=True)
+    if not isinstance(request_data, dict):
+        return jsonify({"error": "Invalid input"}), 400
+    questions = request_data.get("questions", [])
+    submissions = request_data.get("submissions", [])
+    include_details = bool(request_data.get("includeDetails", False))
+
+    if not isinstance(questions, list) or not isinstance(submissions, list) or not questions or not submissions:
+        return jsonify({"error": "Invalid input"}), 400
+
+    for j, question in enumerate(questions):
+        if not isinstance(question, dict) or not isinstance(question.get("answer"), (str, type(None))):
+            return jsonify({"error": f"Question {j} must be an object with a string answer"}), 400
+
+    for i, submission in enumerate(submissions):
+        if not isinstance(submission, dict) or not isinstance(submission.get("userAnswers"), list):
+            return jsonify({"error": f"Submission {i} must be an object with a userAnswers list"}), 400
+        if len(submission["userAnswers"]) != len(questions):
+            return jsonify({"error": f"Submission {i} does not answer every question"}), 400
+        if any(ua is not None and not isinstance(ua, str) for ua in submission["userAnswers"]):
+            return jsonify({"error": f"Submission {i} has an answer that is not a string or null"}), 400
+
+    try:
+        # One row per student, one column per question; "" marks an unattempted question
+        answer_key = np.array([(q.get("answer") or "").strip().upper() for q in questions])
+        answers = np.array([
+            [(ua or "").strip().upper() for ua in submission["userAnswers"]]
+            for submission in submissions
+        ]).reshape(len(submissions), len(questions))
+        subjects = np.array([str(q.get("subject") or "Unknown") for q in questions])
+
+        attempted = answers != ""
+        correct = attempted & (answers == answer_key)
+        incorrect = attempted & ~correct
+        scores = MARKS_CORRECT * correct + MARKS_INCORRECT * incorrect
+
+        total_scores = scores.sum(axis=1)
+        correct_counts = correct.sum(axis=1)
+        incorrect_counts = incorrect.sum(axis=1)
+        unattempted_counts = len(questions) - attempted.sum(axis=1)
+        max_possible_score = len(questions) * MARKS_CORRECT
+        percentages = np.maximum(0, total_scores / max_possible_score * 100)
+
+        subject_names = sorted(set(subjects.tolist()))
+        subject_masks = {name: subjects == name for name in subject_names}
+        subject_scores = {name: scores[:, mask].sum(axis=1) for name, mask in subject_masks.items()}
+
+        student_results = []
+        for i, submission in enumerate(submissions):
+            student = {
+                "studentId": submission.get("studentId", i),
+                "total": len(questions),
+                "score": int(total_scores[i]),
+                "max_score": max_possible_score,
+                "correct_count": int(correct_counts[i]),
+                "incorrect_count": int(incorrect_counts[i]),
+                "unattempted_count": int(unattempted_counts[i]),
+                "percentage": round(float(percentages[i]), 2),
+                "subject_scores": {name: int(subject_scores[name][i]) for name in subject_names}
+            }
+            if include_details:
+                status = np.where(correct[i], "correct", np.where(incorrect[i], "incorrect", "unattempted"))
+                student["details"] = [
+                    {
+                        "correct_answer": answer_key[j],
+                        "user_answer": answers[i, j],
+                        "is_correct": bool(correct[i, j]),
+                        "status": status[j],
+                        "score": int(scores[i, j]),
+                        "subject": subjects[j]
+                    }
+                    for j in range(len(questions))
+                ]
+            student_results.append(student)
+
+        student_count = len(submissions)
+        option_counts = (answers[:, :, None] == OPTION_LABELS).sum(axis=0)
+        question_stats = [
+            {
+                "index": j,
+                "subject": subjects[j],
+                "correct_answer": answer_key[j],
+                "correct_rate": round(float(correct[:, j].mean()), 4),
+                "incorrect_rate": round(float(incorrect[:, j].mean()), 4),
+                "unattempted_rate": round(float(1 - attempted[:, j].mean()), 4),
+                "average_score": round(float(scores[:, j].mean()), 4),
+                "option_counts": dict(zip(OPTION_LABELS.tolist(), option_counts[j].tolist()))
+            }
+            for j in range(len(questions))
+        ]
+
+        subject_stats = {}
+        for name, mask in subject_masks.items():
+            attempted_in_subject = int(attempted[:, mask].sum())
+            subject_stats[name] = {
+                "question_count": int(mask.sum()),
+                "max_score": int(mask.sum()) * MARKS_CORRECT,
+                "average_score": round(float(subject_scores[name].mean()), 2),
+                "highest_score": int(subject_scores[name].max()),
+                "lowest_score": int(subject_scores[name].min()),
+                "accuracy": round(float(correct[:, mask].sum()) / attempted_in_subject, 4) if attempted_in_subject else 0
+            }
+
+        return jsonify({
+            "student_count": student_count,
+            "results": student_results,
+            "class_summary": {
+                "average_score": round(float(total_scores.mean()), 2),
+                "median_score": float(np.median(total_scores)),
+                "highest_score": int(total_scores.max()),
+                "lowest_score": int(total_scores.min()),
+                "average_percentage": round(float(percentages.mean()), 2)
+            },
+            "question_stats": question_stats,
+            "subject_stats": subject_stats,
+            "marking_scheme": {
+                "correct": "+4",
+                "incorrect": "-1",
+                "unattempted": "0"
+            }
+        }), 200
+
+    except Exception as e:
+        print(f"Error evaluating submissions: {str(e)}")
+        return jsonify({"error": f"Failed to evaluate submissions: {str(e)}"}), 500
+
 @app.route('/api/stats', methods=['GET'])
 def get_stats():
     subject_counts = {}
@@ -862,27 +1818,34 @@ def get_stats():
         "total_images": len(images_data),
         "total_associations": len(question_image_associations),
         "subject_distribution": subject_counts,
-        "questions_with_images": len([a for a in question_image_associations])
+        "questions_with_images": len([a for a in question_image_associations]),
+        "generation_yield": yield_model.summary(),
+        "mcq_output": {
+            "mode": MCQ_OUTPUT_MODE,
+            "llm_calls": metrics.counter_total("mcq_llm_calls_total"),
+            "valid_mcqs": metrics.counter_total("mcq_valid_total"),
+            "valid_per_call": (metrics.counter_total("mcq_valid_total") / metrics.counter_total("mcq_llm_calls_total")
+                               if metrics.counter_total("mcq_llm_calls_total") else None)
+        },
+        "write_behind": {
+            "tests": tests_write_queue.stats(),
+            "test_results": results_write_queue.stats()
+        }
     }), 200
 
 def process_all_pdfs_on_startup():
     print("Processing all existing PDFs in folder...")
-    global questions_data, images_data, question_image_associations
-    
-    questions_data.clear()
-    images_data.clear()
-    question_image_associations.clear()
+    reset_indexes()
     
     for filename in os.listdir(pdf_folder):
         if filename.lower().endswith('.pdf'):
             pdf_path = os.path.join(pdf_folder, filename)
             print(f"Processing {filename}...")
             try:
-                extracted_questions, extracted_images, associations = extract_pdf_data_enhanced(pdf_path, output_dir)
-                store_enhanced_data_to_faiss(extracted_questions, extracted_images, associations)
-                print(f"  - Questions: {len(extracted_questions)}")
-                print(f"  - Images: {len(extracted_images)}")
-                print(f"  - Associations: {len(associations)}")
+                totals = ingest_pdf_streaming(pdf_path, output_dir)
+                print(f"  - Questions: {totals['questions']}")
+                print(f"  - Images: {totals['images']}")
+                print(f"  - Associations: {totals['associations']}")
             except Exception as e:
                 print(f"Error processing {filename}: {e}")
     
@@ -890,4 +1853,9 @@ def process_all_pdfs_on_startup():
 
 if __name__ == '__main__':
     process_all_pdfs_on_startup()
+    # Starting the queues replays anything journaled while the server was down
+    tests_write_queue.start()
+    results_write_queue.start()
+    # docker stop sends SIGTERM; exit normally so atexit drains the queues before the SIGKILL
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
\ No newline at end of file
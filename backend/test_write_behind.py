@@ -0,0 +1,120 @@
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+mongomock = pytest.importorskip("mongomock")
+
+from write_behind import WriteBehindQueue
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def collection():
+    return mongomock.MongoClient().db.items
+
+
+def make_queue(tmp_path, get_collection, **kwargs):
+    kwargs.setdefault("flush_interval", 0.01)
+    kwargs.setdefault("replay_interval", 0.05)
+    return WriteBehindQueue("items", get_collection, str(tmp_path / "items.jsonl"), **kwargs)
+
+
+def wal_segments(tmp_path):
+    return [name for name in os.listdir(tmp_path) if ".wal." in name]
+
+
+def test_batches_land_and_wal_is_cleared(tmp_path, collection):
+    written = []
+    wb = make_queue(tmp_path, lambda: collection, on_written=written.extend)
+    ids = [wb.submit({"n": i})[0] for i in range(250)]
+    assert wb.flush(timeout=5)
+    wb.close()
+
+    assert collection.count_documents({}) == 250
+    assert {doc["_id"] for doc in written} == set(ids)
+    assert wal_segments(tmp_path) == []
+
+
+def test_spills_to_journal_and_replays_when_database_returns(tmp_path, collection):
+    available = {"db": None}
+    wb = make_queue(tmp_path, lambda: available["db"])
+    for i in range(5):
+        wb.submit({"n": i})
+    assert wb.flush(timeout=5)
+    assert wb.stats()["journaled"] == 5
+    assert collection.count_documents({}) == 0
+
+    available["db"] = collection
+    wb._replay_journal()
+    wb.close()
+
+    assert collection.count_documents({}) == 5
+    assert wb.stats()["journal_backlog"] == 0
+
+
+def test_replay_is_idempotent_and_reports_duplicates(tmp_path, collection):
+    written = []
+    wb = make_queue(tmp_path, lambda: collection, on_written=written.extend)
+    document = {"n": 1}
+    wb.submit(document)
+    assert wb.flush(timeout=5)
+
+    # The insert landed but its acknowledgement was lost, so the batch was journaled as well
+    wb._append_to_journal([document])
+    wb._replay_journal()
+    wb.close()
+
+    assert collection.count_documents({}) == 1
+    assert [doc["_id"] for doc in written] == [document["_id"]] * 2
+
+
+def test_worker_survives_errors(tmp_path, collection):
+    wb = make_queue(tmp_path, lambda: collection)
+    take_batch = wb._take_batch
+    calls = {"n": 0}
+
+    def flaky_take_batch():
+        calls["n"] += 1
+        if calls["n"] == 1:
+            raise OSError("disk full")
+        return take_batch()
+
+    wb._take_batch = flaky_take_batch
+    wb.submit({"n": 1})
+    assert wb.flush(timeout=5)
+    wb.close()
+
+    assert collection.count_documents({}) == 1
+
+
+def test_acknowledged_documents_survive_a_crash(tmp_path, collection):
+    # The child acknowledges documents while its database hangs, then dies without cleanup
+    child = textwrap.dedent(f"""
+        import os, sys, time
+        sys.path.insert(0, {BACKEND_DIR!r})
+        from write_behind import WriteBehindQueue
+
+        class Hanging:
+            def insert_many(self, documents, ordered=True):
+                time.sleep(60)
+
+        wb = WriteBehindQueue("items", Hanging, {str(tmp_path / "items.jsonl")!r})
+        for i in range(3):
+            print(wb.submit({{"n": i}})[0], flush=True)
+        os._exit(1)
+    """)
+    output = subprocess.run([sys.executable, "-c", child], capture_output=True, text=True, timeout=30).stdout
+    acknowledged = set(output.split())
+    assert len(acknowledged) == 3
+
+    wb = make_queue(tmp_path, lambda: collection)
+    wb.start()
+    wb.flush(timeout=5)
+    wb.close()
+
+    assert {str(doc["_id"]) for doc in collection.find()} == acknowledged
+    assert wal_segments(tmp_path) == []
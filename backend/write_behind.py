@@ -0,0 +1,299 @@
+import glob
+import itertools
+import os
+import queue
+import threading
+import time
+
+from bson import json_util
+from bson.objectid import ObjectId
+from pymongo.errors import BulkWriteError
+
+import metrics
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class WriteBehindQueue:
+    """Buffers inserts for one collection and writes them in batches with insert_many.
+
+    Documents get their ObjectId on submit, so callers can hand the id back before the
+    write lands. Before submit returns, the document is fsynced to a write-ahead log segment,
+    and the segment is deleted once every document in it has been written or journaled. A
+    crash or SIGKILL therefore loses nothing: the next process to start the queue moves
+    leftover segments into the journal. One process per journal directory is assumed.
+    A batch that cannot be written is appended to a local JSON-lines journal,
+    and the journal is replayed once the database answers again. Documents that already made
+    it in are skipped as duplicate keys, but are still handed to `on_written`, which therefore
+    has to tolerate seeing a document more than once.
+
+    `get_collection` is called for every write, so any pymongo-compatible collection
+    (including mongomock) can be swapped in.
+    """
+
+    def __init__(self, name, get_collection, journal_path, batch_size=100, max_pending=1000,
+                 flush_interval=0.05, put_timeout=2.0, replay_interval=5.0, on_written=None):
+        self.name = name
+        self.get_collection = get_collection
+        self.journal_path = journal_path
+        self.replay_path = journal_path + ".replay"
+        self.wal_prefix = journal_path + ".wal"
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.replay_interval = replay_interval
+        self.on_written = on_written
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._journal_lock = threading.Lock()
+        self._wal_lock = threading.Lock()
+        self._wal_segment = None
+        self._wal_sequence = itertools.count(1)
+        self._wal_pending = 0
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._worker = None
+        self._healthy = True
+        self._last_replay = 0.0
+        self._stats = {"written": 0, "batches": 0, "journaled": 0, "replayed": 0, "failures": 0}
+
+        directory = os.path.dirname(journal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def start(self):
+        with self._start_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._stop.clear()
+                self._worker = threading.Thread(target=self._run, name=f"write-behind-{self.name}", daemon=True)
+                self._worker.start()
+
+    def submit(self, document):
+        """Queue a document for insertion. Returns (inserted_id, journaled).
+
+        When the buffer is full the caller waits up to put_timeout (backpressure); if it is
+        still full the document goes straight to the journal rather than being dropped.
+        """
+        self.start()
+        document.setdefault("_id", ObjectId())
+        segment = self._wal_append(document)
+        try:
+            self._queue.put((segment, document), timeout=self.put_timeout)
+            return document["_id"], False
+        except queue.Full:
+            self._append_to_journal([document])
+            self._wal_resolve([segment])
+            return document["_id"], True
+
+    def flush(self, timeout=None):
+        """Block until everything submitted so far has been written or journaled."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(self.flush_interval)
+        return True
+
+    def close(self, timeout=10.0):
+        self._stop.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+        with self._wal_lock:
+            # Anything still unresolved stays on disk for the next process to recover
+            if self._wal_segment is not None:
+                self._wal_segment["file"].close()
+                self._wal_segment = None
+
+    def stats(self):
+        return {
+            **self._stats,
+            "pending": self._queue.qsize(),
+            "healthy": self._healthy,
+            "wal_pending": self._wal_pending,
+            "journal_backlog": self._journal_size()
+        }
+
+    def _run(self):
+        try:
+            self._recover_wal()
+            self._replay_journal()
+        except Exception as e:
+            print(f"⚠️ Write-behind recovery for {self.name} failed, will retry: {e}")
+        while not (self._stop.is_set() and self._queue.empty()):
+            # Documents stay in the write-ahead log until resolved, so an error here loses nothing
+            try:
+                batch = self._take_batch()
+                if batch:
+                    self._write_batch(batch)
+                if time.monotonic() - self._last_replay >= self.replay_interval and self._journal_size():
+                    self._replay_journal()
+            except Exception as e:
+                print(f"⚠️ Write-behind worker for {self.name} hit an error: {e}")
+                self._last_replay = time.monotonic()
+                time.sleep(self.flush_interval)
+
+    def _take_batch(self):
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=self.flush_interval))
+        except queue.Empty:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write_batch(self, batch):
+        segments = [segment for segment, _ in batch]
+        documents = [document for _, document in batch]
+        try:
+            if not self._healthy:
+                # Don't stall every batch on a dead server; the journal replay doubles as the probe
+                self._append_to_journal(documents)
+            else:
+                try:
+                    self._insert(documents)
+                except Exception as e:
+                    print(f"⚠️ Write-behind insert into {self.name} failed, journaling {len(documents)} documents: {e}")
+                    self._healthy = False
+                    self._stats["failures"] += 1
+                    self._append_to_journal(documents)
+            self._wal_resolve(segments)
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def _insert(self, documents):
+        collection = self.get_collection()
+        if collection is None:
+            raise RuntimeError("database unavailable")
+
+        try:
+            with metrics.timer("mongo_operation_seconds", operation="insert_many", collection=self.name):
+                collection.insert_many(documents, ordered=False)
+            inserted = documents
+        except BulkWriteError as e:
+            errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != DUPLICATE_KEY_ERROR for error in errors):
+                raise
+            duplicates = {error["index"] for error in errors}
+            inserted = [doc for i, doc in enumerate(documents) if i not in duplicates]
+
+        self._stats["written"] += len(inserted)
+        self._stats["batches"] += 1
+        # Duplicates still go to the callback: Mongo may have applied an earlier insert and lost the
+        # acknowledgement, in which case the callback never saw them. Callbacks must be idempotent.
+        if self.on_written and documents:
+            try:
+                self.on_written(documents)
+            except Exception as e:
+                print(f"Error in {self.name} write callback: {e}")
+        return inserted
+
+    def _append_to_journal(self, documents):
+        lines = "".join(json_util.dumps(doc) + "\n" for doc in documents)
+        with self._journal_lock:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+                f.flush()
+                os.fsync(f.fileno())
+        self._stats["journaled"] += len(documents)
+
+    def _wal_append(self, document):
+        line = json_util.dumps(document) + "\n"
+        with self._wal_lock:
+            segment = self._wal_segment
+            if segment is None or segment["appended"] >= self.batch_size:
+                if segment is not None:
+                    segment["file"].close()
+                    segment["closed"] = True
+                path = f"{self.wal_prefix}.{os.getpid()}.{next(self._wal_sequence)}"
+                segment = {"path": path, "file": open(path, "a", encoding="utf-8"), "appended": 0, "unresolved": 0, "closed": False}
+                self._wal_segment = segment
+            segment["file"].write(line)
+            segment["file"].flush()
+            os.fsync(segment["file"].fileno())
+            segment["appended"] += 1
+            segment["unresolved"] += 1
+            self._wal_pending += 1
+        return segment
+
+    def _wal_resolve(self, segments):
+        with self._wal_lock:
+            for segment in segments:
+                segment["unresolved"] -= 1
+                self._wal_pending -= 1
+                if segment["unresolved"]:
+                    continue
+                if segment is self._wal_segment:
+                    segment["file"].close()
+                    segment["closed"] = True
+                    self._wal_segment = None
+                if segment["closed"] and os.path.exists(segment["path"]):
+                    os.remove(segment["path"])
+
+    def _recover_wal(self):
+        # Segments left by an earlier process hold documents that may or may not have reached
+        # Mongo; the journal replay inserts whatever is missing
+        own_prefix = f"{self.wal_prefix}.{os.getpid()}."
+        for path in sorted(glob.glob(glob.escape(self.wal_prefix) + ".*")):
+            if path.startswith(own_prefix):
+                continue
+            documents = []
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        documents.append(json_util.loads(line))
+                    except ValueError:
+                        continue
+            if documents:
+                self._append_to_journal(documents)
+            os.remove(path)
+            print(f"✅ Recovered {len(documents)} documents from {os.path.basename(path)} into the {self.name} journal")
+
+    def _journal_size(self):
+        size = 0
+        for path in (self.journal_path, self.replay_path):
+            if os.path.exists(path):
+                size += os.path.getsize(path)
+        return size
+
+    def _replay_journal(self):
+        self._last_replay = time.monotonic()
+        with self._journal_lock:
+            # A leftover .replay file means an earlier replay was interrupted; finish it first
+            if not os.path.exists(self.replay_path):
+                if not os.path.exists(self.journal_path) or not os.path.getsize(self.journal_path):
+                    return
+                os.replace(self.journal_path, self.replay_path)
+
+        documents = []
+        try:
+            with open(self.replay_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        documents.append(json_util.loads(line))
+                    except ValueError:
+                        # Torn final line from a crash mid-append
+                        continue
+        except FileNotFoundError:
+            # Another process sharing the journal (e.g. the debug reloader's parent) replayed it first
+            return
+
+        try:
+            for i in range(0, len(documents), self.batch_size):
+                self._insert(documents[i:i + self.batch_size])
+        except Exception as e:
+            print(f"⚠️ Journal replay for {self.name} failed, will retry: {e}")
+            self._healthy = False
+            return
+
+        try:
+            os.remove(self.replay_path)
+        except FileNotFoundError:
+            pass
+        self._healthy = True
+        self._stats["replayed"] += len(documents)
+        print(f"✅ Replayed {len(documents)} journaled documents into {self.name}")